@@ -0,0 +1,343 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import atexit
+import heapq
+import os
+import socket
+import threading
+
+from pymongo import UpdateOne
+
+from result_cache import normalize_query
+
+FACET_FIELDS = ('intent', 'category', 'quality', 'use_case')
+# Buckets kept in memory and served by the endpoint
+WINDOW = {'hour': 48, 'day': 30}
+BUCKET_SIZE = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+# How long rollup documents are kept in MongoDB (TTL on expires_at)
+RETENTION = {'hour': timedelta(days=7), 'day': timedelta(days=400)}
+# Distinct queries tracked per bucket and worker; rarer ones fall out of the sketch
+QUERY_CAPACITY = 1000
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def encode_key(value):
+    # Query text becomes a field name, which may not contain '.' or start with '$'
+    return value.replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+
+def decode_key(value):
+    return value.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+
+def rollup_for(buckets, key, capacity):
+    # Not setdefault: that would build a Rollup on every recorded search
+    rollup = buckets.get(key)
+    if rollup is None:
+        rollup = buckets[key] = Rollup(capacity)
+    return rollup
+
+
+class SpaceSaving:
+    # Heavy hitters in bounded memory (Metwally et al.): once full, a new item takes the
+    # slot of the smallest count and inherits it, recorded as the item's error bound.
+    # The min-heap has stale entries skipped on pop and is rebuilt when it grows too long
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item, count=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            victim, floor = self._pop_min()
+            del counts[victim], self.errors[victim]
+            counts[item] = floor + count
+            self.errors[item] = floor
+        heapq.heappush(self.heap, (counts[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self._reheap()
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def _reheap(self):
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def merge(self, other):
+        # Counts of shared items add up and the largest are kept: still an approximate top-N
+        for item, count in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+            self.errors[item] = self.errors.get(item, 0) + other.errors.get(item, 0)
+        if len(self.counts) > self.capacity:
+            self.counts = dict(heapq.nlargest(self.capacity, self.counts.items(), key=lambda item: item[1]))
+            self.errors = {item: self.errors[item] for item in self.counts}
+        self._reheap()
+        return self
+
+    def most_common(self, n=None):
+        ordered = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return ordered if n is None else ordered[:n]
+
+    def to_list(self):
+        return [[item, count, self.errors[item]] for item, count in self.most_common()]
+
+    @classmethod
+    def from_list(cls, entries, capacity):
+        sketch = cls(capacity)
+        for item, count, error in entries:
+            sketch.counts[item], sketch.errors[item] = count, error
+        return sketch.merge(cls(capacity))
+
+
+class Rollup:
+    def __init__(self, capacity=QUERY_CAPACITY):
+        self.capacity = capacity
+        self.searches = 0
+        self.zero_results = 0
+        self.queries = SpaceSaving(capacity)
+        self.zero_result_queries = SpaceSaving(capacity)
+        self.facets = {field: Counter() for field in FACET_FIELDS}
+
+    def add(self, query, results_count, facets):
+        self.add_counts(results_count, facets)
+        self.add_query(query, results_count)
+
+    def add_counts(self, results_count, facets):
+        self.searches += 1
+        if not results_count:
+            self.zero_results += 1
+        for field in FACET_FIELDS:
+            self.facets[field][facets.get(field) or 'none'] += 1
+
+    def add_query(self, query, results_count):
+        self.queries.add(query)
+        if not results_count:
+            self.zero_result_queries.add(query)
+
+    def merge(self, other):
+        return self.merge_counts(other).merge_sketches(other)
+
+    def merge_counts(self, other):
+        self.searches += other.searches
+        self.zero_results += other.zero_results
+        for field in FACET_FIELDS:
+            self.facets[field].update(other.facets[field])
+        return self
+
+    def merge_sketches(self, other):
+        self.queries.merge(other.queries)
+        self.zero_result_queries.merge(other.zero_result_queries)
+        return self
+
+    def increments(self):
+        # Facet values come from the SemanticAI vocabulary, so one field per value stays bounded
+        increments = {'searches': self.searches, 'zero_results': self.zero_results}
+        for field in FACET_FIELDS:
+            increments.update({f'facets.{field}.{encode_key(key)}': count for key, count in self.facets[field].items()})
+        return increments
+
+    @classmethod
+    def from_document(cls, document, capacity=QUERY_CAPACITY, skip_worker=None):
+        rollup = cls(capacity)
+        rollup.searches = document.get('searches', 0)
+        rollup.zero_results = document.get('zero_results', 0)
+        for field in FACET_FIELDS:
+            rollup.facets[field] = Counter({decode_key(key): count for key, count in document.get('facets', {}).get(field, {}).items()})
+        for name in ('queries', 'zero_result_queries'):
+            for worker, entries in document.get('sketches', {}).get(name, {}).items():
+                if worker != skip_worker:
+                    getattr(rollup, name).merge(SpaceSaving.from_list(entries, capacity))
+        return rollup
+
+    def summary(self, top):
+        return {
+            'searches': self.searches,
+            'zero_results': self.zero_results,
+            'zero_result_rate': round(self.zero_results / self.searches, 4) if self.searches else 0.0,
+            'top_queries': [{'query': query, 'count': count} for query, count in self.queries.most_common(top)],
+            'zero_result_queries': [{'query': query, 'count': count} for query, count in self.zero_result_queries.most_common(top)],
+            'facets': {field: dict(self.facets[field].most_common()) for field in FACET_FIELDS}
+        }
+
+
+class SearchAnalytics:
+    # Streaming hourly and daily rollups of search events. Counters are written as $inc
+    # deltas, so several worker processes can share one rollup document per bucket.
+    # Query counts are bounded space-saving sketches: each worker $sets its own sketch
+    # (a fixed-size array) and readers merge them. After each write the recent buckets
+    # are read back, and the endpoint is served from summaries precomputed at that point.
+    def __init__(self, get_collection, top=20, flush_interval=10.0, query_capacity=QUERY_CAPACITY):
+        self.get_collection = get_collection
+        self.top = top
+        self.flush_interval = flush_interval
+        self.query_capacity = query_capacity
+        self.worker = encode_key(f'{socket.gethostname()}-{os.getpid()}')
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.buckets = {}
+        # Counter deltas not yet written, and this worker's own query sketches per bucket
+        self.pending = {}
+        self.local = {}
+        self.snapshots = {granularity: self._snapshot(granularity, []) for granularity in WINDOW}
+        self.dirty = False
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='search-analytics', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, query, results_count, facets=None, timestamp=None):
+        query = normalize_query(query)
+        timestamp = timestamp or datetime.now(timezone.utc)
+        with self.lock:
+            for granularity in WINDOW:
+                key = (granularity, bucket_start(timestamp, granularity))
+                rollup_for(self.buckets, key, self.query_capacity).add(query, results_count, facets or {})
+                rollup_for(self.pending, key, 0).add_counts(results_count, facets or {})
+                rollup_for(self.local, key, self.query_capacity).add_query(query, results_count)
+            self.dirty = True
+
+    def _run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                sketches = {key: self._sketches(self.local[key]) for key in pending}
+            collection = self.get_collection()
+            if collection is not None:
+                try:
+                    if pending:
+                        collection.bulk_write([self._upsert(key, rollup, sketches[key]) for key, rollup in pending.items()], ordered=False)
+                        self.flushed += len(pending)
+                        pending = {}
+                    self._sync(collection)
+                except Exception:
+                    self.failed_flushes += 1
+            if pending:
+                # Kept for the next attempt; the in-memory buckets already include them
+                with self.lock:
+                    for key, rollup in pending.items():
+                        self.pending.setdefault(key, Rollup(0)).merge_counts(rollup)
+            self._refresh_snapshots()
+
+    def _sketches(self, rollup):
+        return {
+            f'sketches.queries.{self.worker}': rollup.queries.to_list(),
+            f'sketches.zero_result_queries.{self.worker}': rollup.zero_result_queries.to_list()
+        }
+
+    def _upsert(self, key, rollup, sketches):
+        granularity, start = key
+        # Sketches are cumulative, so $set is safe to repeat after a failed write
+        return UpdateOne(
+            {'_id': f'{granularity}:{start.isoformat()}'},
+            {
+                '$inc': rollup.increments(),
+                '$set': sketches,
+                '$setOnInsert': {'granularity': granularity, 'start': start, 'expires_at': start + RETENTION[granularity]}
+            },
+            upsert=True
+        )
+
+    def _sync(self, collection):
+        # Stored totals include other workers' searches. This worker's stored sketch is
+        # replaced by its live one, and counter deltas not yet written are re-applied
+        now = datetime.now(timezone.utc)
+        buckets = {}
+        for granularity, size in WINDOW.items():
+            oldest = bucket_start(now, granularity) - BUCKET_SIZE[granularity] * (size - 1)
+            for document in collection.find({'granularity': granularity, 'start': {'$gte': oldest}}):
+                start = document['start']
+                if start.tzinfo is None:
+                    start = start.replace(tzinfo=timezone.utc)
+                buckets[(granularity, start)] = Rollup.from_document(document, self.query_capacity, skip_worker=self.worker)
+        with self.lock:
+            for key, rollup in self.local.items():
+                buckets.setdefault(key, Rollup(self.query_capacity)).merge_sketches(rollup)
+            for key, rollup in self.pending.items():
+                buckets.setdefault(key, Rollup(self.query_capacity)).merge_counts(rollup)
+            self.buckets = buckets
+            self.dirty = True
+
+    def _refresh_snapshots(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            now = datetime.now(timezone.utc)
+            by_granularity = {}
+            for granularity, size in WINDOW.items():
+                oldest = bucket_start(now, granularity) - BUCKET_SIZE[granularity] * (size - 1)
+                for key in [key for key in self.buckets if key[0] == granularity and key[1] < oldest]:
+                    del self.buckets[key]
+                for key in [key for key in self.local if key[0] == granularity and key[1] < oldest and key not in self.pending]:
+                    del self.local[key]
+                by_granularity[granularity] = sorted(
+                    ((start, rollup) for (bucket_granularity, start), rollup in self.buckets.items() if bucket_granularity == granularity),
+                    key=lambda item: item[0], reverse=True
+                )
+            self.dirty = False
+            # Summaries are built under the lock so record() cannot change a counter mid-iteration
+            snapshots = {granularity: self._snapshot(granularity, buckets) for granularity, buckets in by_granularity.items()}
+        self.snapshots = snapshots
+
+    def _snapshot(self, granularity, buckets):
+        window = Rollup(self.query_capacity)
+        for start, rollup in buckets:
+            window.merge(rollup)
+        return {
+            'granularity': granularity,
+            'as_of': datetime.now(timezone.utc).isoformat(),
+            'window': {'buckets': len(buckets), **window.summary(self.top)},
+            'buckets': [{'start': start.isoformat(), **rollup.summary(self.top)} for start, rollup in buckets]
+        }
+
+    def snapshot(self, granularity='hour'):
+        return self.snapshots.get(granularity)
+
+    def popular_queries(self, limit=1000):
+        # Queries that returned results, over the daily window
+        with self.lock:
+            totals = Counter()
+            for (granularity, start), rollup in self.buckets.items():
+                if granularity == 'day':
+                    totals.update(dict(rollup.queries.counts))
+                    totals.subtract(dict(rollup.zero_result_queries.counts))
+        return [(query, count) for query, count in totals.most_common(limit) if count > 0]
+
+    def close(self):
+        if not self.stop_event.is_set():
+            self.stop_event.set()
+            self.flush()
+
+    def stats(self):
+        return {
+            'buckets': len(self.buckets),
+            'pending_buckets': len(self.pending),
+            'flushed_buckets': self.flushed,
+            'failed_flushes': self.failed_flushes,
+            'query_capacity': self.query_capacity,
+            'tracked_queries': sum(len(rollup.queries) for rollup in self.buckets.values())
+        }
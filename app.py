@@ -1,77 +1,665 @@
-from flask import Flask, request
+from flask import Flask, Response, g, jsonify, request
+import io
 import json
+import math
 import random
 import re
-from pymongo import MongoClient
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import quote_plus
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+from bson import ObjectId
 from dotenv import load_dotenv
+import numpy as np
 import os
+from search_index import ReadWriteLock, SearchIndex
+from embedding_index import EmbeddingIndex, HashedNgramVectorizer, product_text
+from result_cache import SearchResultCache, normalize_query
+from search_log import SearchLogWriter
+from analytics import FACET_FIELDS as ANALYTICS_FACETS, SearchAnalytics
+from connection import CircuitBreaker, HealthMonitor, PoolStats
+from query_planner import FACET_INDEXES, RENDER_PROJECTION, cursor_fingerprint, decode_cursor, encode_cursor, plan_query
+from suggest import SuggestionIndex
+from metrics import MetricsRegistry, SlowRequestProfiler
+from snapshot import CatalogSnapshot, write_snapshot
+from ranking import anchor_after, blend_semantic, facet_mask, lexical_matches, page_keys, select_page
+from shard_pool import ShardPool
+import ingestion
 
 load_dotenv()
 app = Flask(__name__)
 
+metrics = MetricsRegistry()
+metrics.describe('search_stage_seconds', 'Time spent in each stage of serving a request')
+metrics.describe('http_request_seconds', 'Request latency by route, including streamed bodies')
+# Opt-in: requests slower than this many milliseconds get their sampled stacks dumped
+PROFILE_SLOW_REQUEST_MS = os.getenv('PROFILE_SLOW_REQUEST_MS')
+profiler = SlowRequestProfiler(
+    float(PROFILE_SLOW_REQUEST_MS),
+    interval_ms=float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5')),
+    output_dir=os.getenv('PROFILE_DIR', 'profiles')
+) if PROFILE_SLOW_REQUEST_MS else None
+
+FALLBACK_PRODUCTS = [
+    {"name": "iPhone 15 Pro Max", "description": "Latest Apple smartphone", "category": "mobile_device", "quality": "premium_quality", "price": 1199},
+    {"name": "MacBook Pro M3", "description": "Professional laptop", "category": "computer", "quality": "premium_quality", "price": 1999},
+    {"name": "Sony WH-1000XM5", "description": "Noise canceling headphones", "category": "audio_device", "quality": "premium_quality", "price": 399}
+]
+
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '15'))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '50'))
+
+# Share of the final score taken by embedding similarity (0 disables semantic blending)
+SEMANTIC_WEIGHT = float(os.getenv('SEMANTIC_WEIGHT', '0.3'))
+SEMANTIC_MIN_SIMILARITY = float(os.getenv('SEMANTIC_MIN_SIMILARITY', '0.35'))
+
+KEYWORD_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+PRICE_PATTERN = re.compile(r'under \$?(\d+)')
+QUALITY_LEVELS = ['premium_quality', 'budget_friendly', 'mid_range']
+USE_CASES = ['photography', 'productivity', 'entertainment', 'fitness', 'travel']
+
+# Pool sizing and timeouts; connect=False defers all network I/O to the first operation
+MONGODB_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', '50')),
+    'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', '0')),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '2000')),
+    'connectTimeoutMS': int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', '2000')),
+    'socketTimeoutMS': int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', '5000')),
+    'waitQueueTimeoutMS': int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', '1000')),
+    'retryWrites': True,
+    'connect': False
+}
+# Raw search_history events expire after this many days (0 keeps them); rollups hold the aggregates
+SEARCH_HISTORY_TTL_DAYS = float(os.getenv('SEARCH_HISTORY_TTL_DAYS', '30'))
+# Served while MongoDB is unreachable; CATALOG_SNAPSHOT_EXPORT=1 rewrites it after every full build
+CATALOG_SNAPSHOT = os.getenv('CATALOG_SNAPSHOT', 'catalog.snapshot')
+CATALOG_SNAPSHOT_EXPORT = os.getenv('CATALOG_SNAPSHOT_EXPORT', '0') == '1'
+# Incremental updates tombstone replaced rows; past this share of tombstones the index is rebuilt
+INDEX_COMPACT_RATIO = float(os.getenv('INDEX_COMPACT_RATIO', '0.25'))
+# Worker processes for ranking (0 ranks in this process). Each holds one doc-id range of a
+# snapshot exported to SEARCH_SHARD_SNAPSHOT, re-exported once catalog changes settle
+SEARCH_SHARDS = int(os.getenv('SEARCH_SHARDS', '0'))
+SEARCH_SHARD_SNAPSHOT = os.getenv('SEARCH_SHARD_SNAPSHOT', 'search_shards.snapshot')
+SEARCH_SHARD_SYNC_SECONDS = float(os.getenv('SEARCH_SHARD_SYNC_SECONDS', '2'))
+# Products written by other processes (ingestion.py, other ASGI workers) are polled by their
+# server-side updatedAt stamp (0 disables); the overlap re-reads writes still in flight at the last poll
+CATALOG_SYNC_SECONDS = float(os.getenv('CATALOG_SYNC_SECONDS', '10'))
+CATALOG_SYNC_OVERLAP_SECONDS = float(os.getenv('CATALOG_SYNC_OVERLAP_SECONDS', '30'))
+# Every product write stamps updatedAt with the server's clock, so one process's mark holds for all writers
+STAMP_UPDATED_AT = {'$currentDate': {'updatedAt': True}}
+
+def create_client(uri, event_listeners=()):
+    # mongomock:// runs against an in-memory stand-in (benchmarks, local development)
+    if uri and uri.startswith('mongomock://'):
+        import mongomock
+        return mongomock.MongoClient()
+    return MongoClient(uri, event_listeners=list(event_listeners), **MONGODB_OPTIONS)
+
+def doc_key(product):
+    return product.get('product_id', product.get('_id'))
+
 class MongoDBManager:
     def __init__(self):
+        # First, so the shard workers are forked from a process with no threads yet
+        self.shards = ShardPool(SEARCH_SHARDS) if SEARCH_SHARDS > 0 else None
+        self.shard_sync = threading.Event()
+        self.catalog_generation = 0
+        self.catalog_listeners = []
+        # index_lock guards the index columns between readers and in-place updates;
+        # update_lock serializes the writers (rebuilds and incremental batches)
+        self.index_lock = ReadWriteLock()
+        self.update_lock = threading.RLock()
+        self.doc_ids_by_key = {}
+        self.index = SearchIndex()
+        self.embeddings = self.create_embedding_index()
+        self.index_source = None
+        self.synced_until = None
+        self.synced_products = 0
+        self.snapshot = None
+        self.snapshot_error = None
+        self.pool_stats = PoolStats()
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('MONGODB_BREAKER_FAILURES', '3')),
+            reset_timeout=float(os.getenv('MONGODB_BREAKER_RESET_SECONDS', '30'))
+        )
+        self.health = HealthMonitor(
+            self.ping, on_up=self.on_connection_up,
+            interval=float(os.getenv('MONGODB_HEALTH_INTERVAL_SECONDS', '15')),
+            backoff_max=float(os.getenv('MONGODB_RECONNECT_MAX_SECONDS', '60'))
+        )
+        # Created by the first health check, off the import path
+        self.client = self.db = None
+        self.products = self.searches = self.rollups = None
+        self.search_log = SearchLogWriter(
+            lambda: self.searches if self.connected else None,
+            spool_path=os.getenv('SEARCH_LOG_SPOOL', 'search_history.spool.jsonl'),
+            max_queue=int(os.getenv('SEARCH_LOG_QUEUE', '10000')),
+            batch_size=int(os.getenv('SEARCH_LOG_BATCH', '500')),
+            flush_interval=float(os.getenv('SEARCH_LOG_FLUSH_SECONDS', '2'))
+        )
+        self.analytics = SearchAnalytics(
+            lambda: self.rollups if self.available() else None,
+            top=int(os.getenv('ANALYTICS_TOP_QUERIES', '20')),
+            flush_interval=float(os.getenv('ANALYTICS_FLUSH_SECONDS', '10')),
+            query_capacity=int(os.getenv('ANALYTICS_QUERY_CAPACITY', '1000'))
+        )
+        # Serve fallback data right away; the health monitor connects in the background
+        self.build_index()
+        if self.shards is not None:
+            self.start_shard_sync()
+        self.health.start()
+        if CATALOG_SYNC_SECONDS > 0:
+            threading.Thread(target=self.run_catalog_sync, name='catalog-sync', daemon=True).start()
+    
+    @property
+    def connected(self):
+        return self.health.healthy
+    
+    @property
+    def error(self):
+        return self.health.last_error
+    
+    def ping(self):
+        if self.client is None:
+            self.connect()
         try:
-            self.client = MongoClient(os.getenv('MONGODB_URI'))
-            self.db = self.client[os.getenv('DATABASE_NAME', 'semantic_search')]
-            self.products = self.db['products']
-            self.searches = self.db['search_history']
             self.client.admin.command('ping')
-            self.connected = True
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+    
+    def connect(self):
+        # mongodb+srv:// URIs resolve SRV records in the constructor, so a DNS failure
+        # raises here and is retried with the health monitor's backoff
+        client = create_client(os.getenv('MONGODB_URI'), [self.pool_stats])
+        db = client[os.getenv('DATABASE_NAME', 'semantic_search')]
+        self.products, self.searches, self.rollups = db['products'], db['search_history'], db['search_rollups']
+        self.client, self.db = client, db
+    
+    def on_connection_up(self):
+        # Replace fallback data with the real catalog once MongoDB is reachable
+        self.setup_indexes()
+        self.setup_log_indexes()
+        if self.index_source != 'mongodb':
+            self.build_index()
+        else:
+            # Still MongoDB's catalog from before the outage; catch up on writes made meanwhile
+            self.sync_catalog()
+    
+    def wait_until_connected(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not self.connected and time.monotonic() < deadline:
+            if not self.health.check():
+                time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+        return self.connected
+    
+    def available(self):
+        # Fail fast while the circuit breaker is open instead of waiting on timeouts
+        return self.connected and self.breaker.allow()
+    
+    def record_result(self, ok):
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+    
+    def record_error(self, error):
+        # Only driver errors count against MongoDB's health. An OperationFailure is the
+        # server answering (a duplicate key, a rejected write); anything else is local
+        if isinstance(error, PyMongoError) and not isinstance(error, OperationFailure):
+            self.record_result(False)
+    
+    def create_embedding_index(self):
+        return EmbeddingIndex(
+            HashedNgramVectorizer(int(os.getenv('EMBEDDING_DIMS', '512'))),
+            ivf_min_rows=int(os.getenv('EMBEDDING_IVF_MIN_ROWS', '100000'))
+        )
+    
+    def build_index(self):
+        with self.update_lock:
+            return self._build_index()
+    
+    def _build_index(self):
+        products = FALLBACK_PRODUCTS
+        source = 'fallback'
+        if self.available():
+            try:
+                # Mark taken before the read: a write racing it is read again by the next sync
+                latest = self.products.find_one({'updatedAt': {'$exists': True}}, {'updatedAt': 1}, sort=[('updatedAt', -1)])
+                products = list(self.products.find({}, RENDER_PROJECTION))
+                source = 'mongodb'
+                self.synced_until = latest['updatedAt'] if latest else None
+                self.record_result(True)
+            except Exception as e:
+                self.record_error(e)
+                products = FALLBACK_PRODUCTS
+        if source == 'fallback' and self.load_snapshot():
+            return len(self.index.docs)
+        count = self.install_catalog(products, source)
+        if source == 'mongodb' and CATALOG_SNAPSHOT_EXPORT:
+            self.export_snapshot()
+        return count
+    
+    def install_catalog(self, products, source):
+        # Built off to the side and swapped in, so requests never see a half-built index.
+        # Both indexes assign doc ids in insertion order, so ids line up for blending
+        index = SearchIndex()
+        embeddings = self.create_embedding_index()
+        embeddings.build(products)
+        count = index.build(products)
+        doc_ids_by_key = {
+            doc_key(product): doc_id for doc_id, product in enumerate(index.docs) if doc_key(product) is not None
+        }
+        with self.index_lock.write():
+            self.index, self.embeddings, self.doc_ids_by_key, self.index_source = index, embeddings, doc_ids_by_key, source
+            self.snapshot = None
+            self.catalog_generation += 1
+        self.notify_catalog_change()
+        return count
+    
+    def load_snapshot(self):
+        # Read-only and zero-copy: the indexes read straight from the mapped file
+        if not CATALOG_SNAPSHOT or not os.path.exists(CATALOG_SNAPSHOT):
+            return False
+        try:
+            snapshot = CatalogSnapshot(CATALOG_SNAPSHOT)
+            index, embeddings, keys = snapshot.search_index(), snapshot.embedding_index(), snapshot.keys()
         except Exception as e:
-            self.connected = False
-            self.error = str(e)
+            self.snapshot_error = str(e)
+            return False
+        with self.index_lock.write():
+            self.snapshot, self.snapshot_error = snapshot, None
+            self.index, self.embeddings, self.doc_ids_by_key, self.index_source = index, embeddings, keys, 'snapshot'
+            self.catalog_generation += 1
+        self.notify_catalog_change()
+        return True
+    
+    def export_snapshot(self, path=None):
+        try:
+            with self.index_lock.read():
+                return write_snapshot(path or CATALOG_SNAPSHOT, self.index, self.embeddings, source=self.index_source)
+        except Exception as e:
+            self.snapshot_error = str(e)
+            return None
+    
+    def index_products(self, products):
+        with self.update_lock:
+            if self.index_source != 'mongodb':
+                # Fallback and snapshot indexes are not updated in place; read the whole catalog instead
+                self.build_index()
+                return
+            # Rows identical to the indexed document are skipped, so re-loading a file
+            # leaves no tombstones behind
+            products = [product for product in products if not self.is_indexed(product)]
+            if not products:
+                return
+            # Encoded before taking the write lock, so searches only wait for the appends
+            vectors = self.embeddings.vectorizer.encode([product_text(product) for product in products])
+            with self.index_lock.write():
+                # Incremental update: replaced products are tombstoned and re-added at the end
+                replaced = []
+                for product in products:
+                    key = doc_key(product)
+                    old_doc_id = self.doc_ids_by_key.get(key)
+                    if old_doc_id is not None:
+                        self.index.remove(old_doc_id)
+                        replaced.append(old_doc_id)
+                    doc_id = self.index.add(product)
+                    if key is not None:
+                        self.doc_ids_by_key[key] = doc_id
+                self.embeddings.add_many(products, vectors)
+                for doc_id in replaced:
+                    self.embeddings.remove(doc_id)
+                self.catalog_generation += 1
+            if len(self.index.deleted) > INDEX_COMPACT_RATIO * len(self.index.docs):
+                # Tombstoned rows still take postings and embedding rows; rebuild from the live ones
+                live = [product for doc_id, product in enumerate(self.index.docs) if doc_id not in self.index.deleted]
+                self.install_catalog(live, self.index_source)
+                return
+        self.notify_catalog_change()
+    
+    def is_indexed(self, product):
+        doc_id = self.doc_ids_by_key.get(doc_key(product))
+        if doc_id is None or doc_id in self.index.deleted:
+            return False
+        indexed = self.index.docs[doc_id]
+        return all(indexed.get(field) == value for field, value in product.items() if field != '_id')
+    
+    def notify_catalog_change(self):
+        # catalog_generation is bumped under the index write lock, together with the change,
+        # so a reader holding the read lock sees an index and generation that belong together
+        self.shard_sync.set()
+        for listener in self.catalog_listeners:
+            listener()
+    
+    def start_shard_sync(self):
+        self.sync_shards()
+        threading.Thread(target=self.run_shard_sync, name='shard-sync', daemon=True).start()
+        return self.shards
+    
+    def run_shard_sync(self):
+        while not self.shards.closed:
+            self.shard_sync.wait()
+            # Bursts of changes (bulk ingestion) settle into one export; stale shards are
+            # bypassed meanwhile, so requests are ranked in process until the reload
+            time.sleep(SEARCH_SHARD_SYNC_SECONDS)
+            self.sync_shards()
+    
+    def sync_shards(self):
+        self.shard_sync.clear()
+        # Generation first: a change made after this read leaves the shards stale, never wrongly current
+        generation = self.catalog_generation
+        try:
+            with self.index_lock.read():
+                index, embeddings, source, snapshot = self.index, self.embeddings, self.index_source, self.snapshot
+                if source == 'snapshot' and snapshot is not None:
+                    path = snapshot.path
+                else:
+                    path = write_snapshot(SEARCH_SHARD_SNAPSHOT, index, embeddings, source=source)['path']
+                documents = len(index.docs)
+            self.shards.load(path, documents, generation)
+            return True
+        except Exception as e:
+            self.shards.last_error = str(e)
+            return False
     
     def setup_indexes(self):
-        if self.connected:
+        if self.available():
             try:
                 self.products.create_index([("name", "text"), ("description", "text")])
+                self.products.create_index("product_id", unique=True, sparse=True)
+                self.products.create_index("updatedAt")
+                for keys in FACET_INDEXES:
+                    self.products.create_index(keys)
                 return True
             except:
                 return False
         return False
     
+    def setup_log_indexes(self):
+        try:
+            if SEARCH_HISTORY_TTL_DAYS > 0:
+                self.searches.create_index("timestamp", expireAfterSeconds=int(SEARCH_HISTORY_TTL_DAYS * 86400))
+            self.rollups.create_index("expires_at", expireAfterSeconds=0)
+            self.rollups.create_index([("granularity", 1), ("start", 1)])
+            return True
+        except Exception:
+            # An existing index with other options is left as it is
+            return False
+    
     def insert_product(self, product_data):
-        if self.connected:
-            return self.products.insert_one(product_data)
+        if self.available():
+            try:
+                # An upsert on a fresh _id inserts, and unlike insert_one can stamp updatedAt
+                product_data.setdefault('_id', ObjectId())
+                fields = {field: value for field, value in product_data.items() if field != '_id'}
+                result = self.products.update_one({'_id': product_data['_id']}, {'$set': fields, **STAMP_UPDATED_AT}, upsert=True)
+            except Exception as e:
+                self.record_error(e)
+                raise
+            self.record_result(True)
+            self.index_products([product_data])
+            return result
         return None
     
-    def search_products(self, query):
-        if not self.connected:
-            return []
+    def upsert_products(self, products):
+        if not products or not self.available():
+            return None
         try:
-            results = list(self.products.find({
-                "$or": [
-                    {"name": {"$regex": query, "$options": "i"}},
-                    {"description": {"$regex": query, "$options": "i"}},
-                    {"category": {"$regex": query, "$options": "i"}}
-                ]
-            }).limit(15))
-            return results
-        except:
-            return []
-    
-    def log_search(self, query, results_count):
-        if self.connected:
+            result = self.products.bulk_write(
+                [UpdateOne({"product_id": p["product_id"]}, {"$set": p, **STAMP_UPDATED_AT}, upsert=True) for p in products],
+                ordered=False
+            )
+        except Exception as e:
+            self.record_error(e)
+            raise
+        self.record_result(True)
+        self.index_products(products)
+        return result
+    
+    def run_catalog_sync(self):
+        while True:
+            time.sleep(CATALOG_SYNC_SECONDS)
             try:
-                self.searches.insert_one({
-                    "query": query,
-                    "results_count": results_count,
-                    "timestamp": {"$currentDate": True}
-                })
-            except:
+                self.sync_catalog()
+            except Exception:
                 pass
     
+    def sync_catalog(self):
+        # Feeds index_products the documents stamped since the high-water mark; unchanged
+        # ones (this process's own writes, the overlap) are skipped there
+        if self.index_source != 'mongodb' or not self.available():
+            return 0
+        query = {'updatedAt': {'$exists': True}}
+        if self.synced_until is not None:
+            query = {'updatedAt': {'$gte': self.synced_until - timedelta(seconds=CATALOG_SYNC_OVERLAP_SECONDS)}}
+        try:
+            products = list(self.products.find(query, {**RENDER_PROJECTION, 'updatedAt': 1}).sort('updatedAt', 1))
+            self.record_result(True)
+        except Exception as e:
+            self.record_error(e)
+            return 0
+        if not products:
+            return 0
+        synced_until = products[-1]['updatedAt']
+        for product in products:
+            del product['updatedAt']
+        self.index_products(products)
+        self.synced_until = max(self.synced_until or synced_until, synced_until)
+        self.synced_products += len(products)
+        return len(products)
+    
+    @metrics.timed('fetch_products')
+    def get_products(self, doc_ids, docs=None):
+        # docs: the documents of the index the ids were ranked against (search_page returns
+        # them), which a rebuild or compaction may have replaced since
+        docs = self.index.docs if docs is None else docs
+        return [docs[doc_id] for doc_id in doc_ids]
+    
+    @metrics.timed('plan')
+    def plan_search(self, semantic_data):
+        return plan_query(semantic_data, self.index.facet_lookup['category'])
+    
+    @metrics.timed('retrieve')
+    def search_page(self, query, page_size=15, semantic_weight=SEMANTIC_WEIGHT, plan=None, sort='relevance', position=None):
+        # position is the decoded cursor of the previous page. It pins the stage and mode
+        # that produced the first page, so every page walks the same ordering
+        generation = self.catalog_generation
+        stages = [(None, False)]
+        if plan is not None and plan.facets:
+            # Quality is a soft facet: if nothing matches with it, retry without it
+            stages = [(plan, False)] + ([(plan.without_quality(), True)] if plan.quality is not None else [])
+        if position is not None:
+            # A cursor names a stage and mode; both must exist for this plan
+            stages = [stage for stage in stages if stage[1] == position['r']]
+            if not stages or (position['m'] == 'browse' and stages[0][0] is None):
+                raise ValueError('Cursor does not belong to this search')
+        
+        for stage_plan, relaxed in stages:
+            modes = ['rank', 'browse'] if stage_plan is not None else ['rank']
+            for mode in ([position['m']] if position is not None else modes):
+                approximate = False
+                if mode == 'rank':
+                    after = (position['k'], position['d']) if position is not None else None
+                    reanchor = position is not None and position.get('g') != generation
+                    doc_ids, keys, remaining, total, approximate, docs = self.rank_page(query, page_size, semantic_weight,
+                                                                                        stage_plan, sort, after, reanchor)
+                    next_position = {'k': keys[-1], 'd': doc_ids[-1], 'g': generation} if remaining > page_size else None
+                    executed_by = 'in-memory index'
+                else:
+                    # Facets alone describe the request ("cheap laptops under $500"): browse them via the index
+                    doc_ids, next_position, total, executed_by, docs = self.browse_page(stage_plan, page_size, sort, position)
+                if doc_ids or position is not None:
+                    if next_position is not None:
+                        next_position.update({'m': mode, 'r': relaxed})
+                    return {
+                        'doc_ids': doc_ids, 'docs': docs, 'next': next_position, 'total': total,
+                        'total_relation': 'gte' if approximate else 'eq', 'mode': mode, 'relaxed': relaxed, 'executed_by': executed_by
+                    }
+        return {
+            'doc_ids': [], 'docs': [], 'next': None, 'total': 0, 'total_relation': 'eq', 'mode': None, 'relaxed': False,
+            'executed_by': None
+        }
+    
+    @metrics.timed('rank')
+    def rank_page(self, query, limit=15, semantic_weight=SEMANTIC_WEIGHT, plan=None, sort='relevance', after=None, reanchor=False):
+        # Ranked from the in-memory indexes, which mirror the products collection. Every
+        # match is scored, which gives the total and makes page n cost the same as page 1.
+        # A cursor from an earlier catalog is re-anchored here, where every key is at hand
+        if not (semantic_weight > 0 and len(self.embeddings)):
+            semantic_weight = 0.0
+        if not reanchor and self.shards is not None:
+            with self.index_lock.read():
+                docs, generation = self.index.docs, self.catalog_generation
+            if self.shards.ready(generation):
+                try:
+                    return (*self.shards.rank_page(query, limit, semantic_weight, plan, sort, after, SEMANTIC_MIN_SIMILARITY), docs)
+                except Exception:
+                    pass
+        
+        with self.index_lock.read():
+            index, embeddings = self.index, self.embeddings
+            mask = facet_mask(index, plan) if plan is not None else None
+            doc_ids, scores = lexical_matches(index, query, mask)
+            approximate = False
+            if semantic_weight > 0:
+                max_lexical = (float(scores.max()) if len(scores) else 0.0) or 1.0
+                doc_ids, scores = blend_semantic(embeddings, query, doc_ids, scores, semantic_weight,
+                                                 SEMANTIC_MIN_SIMILARITY, max_lexical, mask)
+                approximate = embeddings.ivf is not None
+            keys = page_keys(index, doc_ids, scores, sort)
+        if reanchor and after is not None:
+            after = anchor_after(doc_ids, keys, after)
+        page, keys, remaining = select_page(doc_ids, keys, limit, after)
+        return page, keys, remaining, len(doc_ids), approximate, index.docs
+    
+    @metrics.timed('browse')
+    def browse_page(self, plan, limit=15, sort='relevance', position=None):
+        descending = sort == 'price_desc'
+        with self.index_lock.read():
+            index, doc_ids_by_key = self.index, self.doc_ids_by_key
+            mask = facet_mask(index, plan)
+            if index.deleted:
+                mask[list(index.deleted)] = False
+        total = int(np.count_nonzero(mask))
+        
+        if self.available() and (position is None or 'o' in position):
+            try:
+                after = None
+                if position is not None:
+                    after = (position['p'], ObjectId(position['o']) if position.get('t') == 'oid' else position['o'])
+                direction = -1 if descending else 1
+                products = list(
+                    self.products.find(plan.mongo_filter(after, descending), dict(RENDER_PROJECTION))
+                    .sort([("price", direction), ("_id", direction)]).limit(limit + 1)
+                )
+                self.record_result(True)
+                doc_ids = [doc_ids_by_key.get(doc_key(product)) for product in products[:limit]]
+                doc_ids = [doc_id for doc_id in doc_ids if doc_id is not None]
+                next_position = None
+                if len(products) > limit:
+                    last = products[limit - 1]
+                    next_position = {
+                        'p': last['price'],
+                        'o': str(last['_id']) if isinstance(last['_id'], ObjectId) else last['_id'],
+                        't': 'oid' if isinstance(last['_id'], ObjectId) else 'value',
+                        # Lets the in-memory path carry on if MongoDB goes away between pages
+                        'k': -last['price'] if descending else last['price'],
+                        'd': doc_ids[-1] if doc_ids else -1
+                    }
+                return doc_ids, next_position, total, 'mongodb', index.docs
+            except Exception as e:
+                self.record_error(e)
+        
+        # Fallback data lives only in memory, so filter the columns instead
+        doc_ids = np.flatnonzero(mask)
+        with self.index_lock.read():
+            prices = np.frombuffer(index.prices, dtype=np.float64)[doc_ids]
+        after = (position['k'], position['d']) if position is not None else None
+        page, keys, remaining = select_page(doc_ids, -prices if descending else prices, limit, after)
+        next_position = {'k': keys[-1], 'd': page[-1]} if remaining > limit else None
+        return page, next_position, total, 'in-memory columns', index.docs
+    
+    def explain_search(self, query, plan, semantic_weight=SEMANTIC_WEIGHT, sort='relevance', limit=15):
+        # Runs the first page to find the stage and mode search_page settles on; only a
+        # browse answered by MongoDB has a query plan to show
+        page = self.search_page(query, limit, semantic_weight, plan, sort)
+        explanation = {
+            'facets': plan.facets,
+            'quality_relaxed': page['relaxed'],
+            'mode': page['mode'],
+            'executed_by': page['executed_by'],
+            'total_hits': page['total'],
+            'returned': len(page['doc_ids'])
+        }
+        if page['executed_by'] != 'mongodb':
+            return explanation
+        stage_plan = plan.without_quality() if page['relaxed'] else plan
+        direction = -1 if sort == 'price_desc' else 1
+        explanation.update(stage_plan.describe())
+        explanation['sort'] = [['price', direction], ['_id', direction]]
+        try:
+            raw = (self.products.find(stage_plan.mongo_filter(descending=direction < 0), dict(RENDER_PROJECTION))
+                   .sort([("price", direction), ("_id", direction)]).limit(limit).explain())
+            winning_plan = raw.get('queryPlanner', {}).get('winningPlan', {})
+            stages = []
+            stage = winning_plan
+            while stage:
+                stages.append(stage.get('stage'))
+                if stage.get('indexName'):
+                    explanation['index_used'] = stage['indexName']
+                stage = stage.get('inputStage')
+            stats = raw.get('executionStats', {})
+            explanation.update({
+                'executed_by': 'mongodb',
+                'stages': stages,
+                'collection_scan': 'COLLSCAN' in stages,
+                'docs_examined': stats.get('totalDocsExamined'),
+                'keys_examined': stats.get('totalKeysExamined'),
+                'returned': stats.get('nReturned')
+            })
+        except Exception as e:
+            explanation['explain_error'] = str(e)
+        return explanation
+    
+    @metrics.timed('log_search')
+    def log_search(self, query, results_count, semantic_data=None):
+        # Queued for the background writer; spooled to disk while MongoDB is unavailable
+        facets = {field: semantic_data.get(field) for field in ANALYTICS_FACETS} if semantic_data else {}
+        self.search_log.record(query, results_count, **facets)
+        self.analytics.record(query, results_count, facets)
+    
     def get_product_count(self):
-        if self.connected:
+        if self.available():
             try:
-                return self.products.count_documents({})
-            except:
+                count = self.products.count_documents({})
+                self.record_result(True)
+                return count
+            except Exception as e:
+                self.record_error(e)
                 return 0
         return 0
+    
+    def connection_stats(self):
+        pool = {option: value for option, value in MONGODB_OPTIONS.items() if option != 'connect'}
+        return {
+            'pool': {**pool, **self.pool_stats.stats()},
+            'breaker': self.breaker.stats(),
+            'health': self.health.stats(),
+            'index_source': self.index_source,
+            'catalog_sync': {
+                'synced_until': self.synced_until.isoformat() if self.synced_until else None,
+                'products': self.synced_products
+            },
+            'snapshot': self.snapshot.stats() if self.snapshot else None,
+            'snapshot_error': self.snapshot_error
+        }
 
 class CurrencyConverter:
-    def __init__(self):
+    def __init__(self, rates_file=None, reload_interval=5.0):
         self.rates = {
             'USD': 1.0, 'EUR': 0.85, 'GBP': 0.73, 'JPY': 110.0,
             'CAD': 1.25, 'AUD': 1.35, 'INR': 75.0, 'CNY': 6.5
@@ -80,18 +668,76 @@ class CurrencyConverter:
             'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥',
             'CAD': 'C$', 'AUD': 'A$', 'INR': '₹', 'CNY': '¥'
         }
+        self.whole_unit_currencies = {'JPY', 'INR'}
+        self.version = 0
+        self.rates_label = 'builtin'
+        self.rates_file = rates_file
+        self.rates_mtime = None
+        self.reload_interval = reload_interval
+        self.last_reload_check = 0.0
+        self.reload_rates()
+    
+    def reload_rates(self):
+        # Rates file: {"version": "...", "rates": {"EUR": 0.92, ...}, "symbols": {...}}
+        if not self.rates_file:
+            return False
+        try:
+            mtime = os.path.getmtime(self.rates_file)
+            if mtime == self.rates_mtime:
+                return False
+            with open(self.rates_file, encoding='utf-8') as f:
+                data = json.load(f)
+            rates = {code: float(rate) for code, rate in data['rates'].items()}
+        except Exception as e:
+            self.error = str(e)
+            return False
+        
+        self.rates = {**self.rates, **rates}
+        self.symbols = {**self.symbols, **data.get('symbols', {})}
+        self.rates_mtime = mtime
+        self.version += 1
+        self.rates_label = str(data.get('version', self.version))
+        return True
+    
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self.last_reload_check >= self.reload_interval:
+            self.last_reload_check = now
+            self.reload_rates()
     
     def convert_price(self, usd_price, target_currency):
         if target_currency not in self.rates:
             return f"${usd_price}"
         
         converted = usd_price * self.rates[target_currency]
-        symbol = self.symbols[target_currency]
+        symbol = self.symbols.get(target_currency, target_currency + ' ')
         
-        if target_currency in ['JPY', 'INR']:
+        if target_currency in self.whole_unit_currencies:
             return f"{symbol}{int(converted)}"
         else:
             return f"{symbol}{converted:.2f}"
+    
+    def convert_prices(self, usd_prices, target_currency):
+        return np.asarray(usd_prices, dtype=np.float64) * self.rates.get(target_currency, 1.0)
+    
+    @metrics.timed('currency_format')
+    def format_prices(self, usd_prices, target_currency):
+        if target_currency not in self.rates:
+            return [f"${usd_price}" for usd_price in usd_prices]
+        
+        converted = self.convert_prices(usd_prices, target_currency)
+        if target_currency in self.whole_unit_currencies:
+            amounts = converted.astype(np.int64).astype(str)
+        else:
+            amounts = np.char.mod('%.2f', converted)
+        return np.char.add(self.symbols.get(target_currency, target_currency + ' '), amounts).tolist()
+    
+    def stats(self):
+        return {
+            'version': self.version,
+            'rates': self.rates_label,
+            'currencies': len(self.rates)
+        }
 
 class SemanticAI:
     def __init__(self):
@@ -114,37 +760,54 @@ class SemanticAI:
             'fitness': ['fitness', 'workout', 'exercise', 'running', 'sports', 'health', 'tracking'],
             'travel': ['travel', 'portable', 'lightweight', 'compact', 'on-the-go', 'mobile']
         }
+        self.compile_mappings()
+    
+    def compile_mappings(self):
+        # Keywords become token tuples in one lookup table, so a query is matched in a
+        # single scan whose cost does not grow with the number of synonyms
+        self.phrase_facets = {}
+        for facet, keywords in self.semantic_mappings.items():
+            for keyword in keywords:
+                phrase = tuple(KEYWORD_TOKEN_PATTERN.findall(keyword.lower()))
+                if phrase:
+                    self.phrase_facets.setdefault(phrase, []).append(facet)
+        self.max_phrase_length = max((len(phrase) for phrase in self.phrase_facets), default=0)
+        
+        facets = list(self.semantic_mappings)
+        self.intent_types = [f for f in facets if f.endswith('_intent')]
+        self.quality_types = [f for f in facets if f in QUALITY_LEVELS]
+        self.category_types = [f for f in facets if not f.endswith('_intent') and f not in QUALITY_LEVELS]
+        self.use_case_types = [f for f in facets if f in USE_CASES]
     
+    def match_facets(self, query_lower):
+        tokens = KEYWORD_TOKEN_PATTERN.findall(query_lower)
+        matched = set()
+        for start in range(len(tokens)):
+            for end in range(start + 1, min(start + self.max_phrase_length, len(tokens)) + 1):
+                phrase = tuple(tokens[start:end])
+                last = phrase[-1]
+                # Also try the singular form of the last word ("laptops" -> "laptop")
+                for candidate in (phrase, phrase[:-1] + (last[:-1],), phrase[:-1] + (last[:-2],)):
+                    facets = self.phrase_facets.get(candidate)
+                    if facets:
+                        matched.update(facets)
+                    if not last.endswith('s'):
+                        break
+        return matched
+    
+    @metrics.timed('semantic_extract')
     def extract_semantic_meaning(self, query):
         query_lower = query.lower()
+        matched = self.match_facets(query_lower)
         
-        intent = 'search'
-        for intent_type, keywords in self.semantic_mappings.items():
-            if intent_type.endswith('_intent') and any(keyword in query_lower for keyword in keywords):
-                intent = intent_type.replace('_intent', '')
-                break
-        
-        category = None
-        for cat_type, keywords in self.semantic_mappings.items():
-            if not cat_type.endswith('_intent') and not cat_type.endswith('_quality') and any(keyword in query_lower for keyword in keywords):
-                category = cat_type
-                break
-        
-        quality = 'mid_range'
-        for quality_type, keywords in self.semantic_mappings.items():
-            if quality_type.endswith('_quality') and any(keyword in query_lower for keyword in keywords):
-                quality = quality_type
-                break
-        
-        use_case = None
-        use_cases = ['photography', 'productivity', 'entertainment', 'fitness', 'travel']
-        for case in use_cases:
-            if case in self.semantic_mappings and any(keyword in query_lower for keyword in self.semantic_mappings[case]):
-                use_case = case
-                break
+        # First match in mapping order wins within each facet group
+        intent = next((f.replace('_intent', '') for f in self.intent_types if f in matched), 'search')
+        category = next((f for f in self.category_types if f in matched), None)
+        quality = next((f for f in self.quality_types if f in matched), 'mid_range')
+        use_case = next((f for f in self.use_case_types if f in matched), None)
         
         price_constraint = None
-        price_match = re.search(r'under \$?(\d+)', query_lower)
+        price_match = PRICE_PATTERN.search(query_lower)
         if price_match:
             price_constraint = int(price_match.group(1))
         
@@ -154,9 +817,11 @@ class SemanticAI:
             'quality': quality,
             'use_case': use_case,
             'price_constraint': price_constraint,
+            'matched_facets': sorted(matched),
             'original_query': query
         }
     
+    @metrics.timed('semantic_response')
     def generate_semantic_response(self, semantic_data):
         intent = semantic_data['intent']
         category = semantic_data['category']
@@ -187,10 +852,71 @@ class SemanticAI:
         
         return "\n".join(response_parts)
 
+EXTERNAL_SOURCES = [
+    ('Google', 'https://www.google.com/search?tbm=shop&q={query}'),
+    ('Amazon', 'https://www.amazon.com/s?k={query}'),
+    ('Bing', 'https://www.bing.com/search?q={query}+buy')
+]
+EXTERNAL_PRICE_RANGES = {'premium_quality': (600, 1500), 'mid_range': (200, 600), 'budget_friendly': (50, 200)}
+
+# Compiled once; templates without a file name are autoescaped by Flask
+RESULTS_TEMPLATE = app.jinja_env.from_string('''{% for product in results %}
+        <div class="product">
+            <div class="product-name">{{ product.name }}</div>
+            <div class="product-desc">{{ product.desc }}</div>
+            <div class="product-footer">
+                <div class="product-price">{{ product.price }}</div>
+                <span class="{{ 'db-badge' if product.is_db else 'source-badge' }}">{{ product.source }}</span>
+                <a href="{{ product.url }}" target="_blank" class="visit-btn">Visit</a>
+            </div>
+        </div>
+{% endfor %}''')
+
 # Initialize components
 mongo_db = MongoDBManager()
 semantic_ai = SemanticAI()
-currency_converter = CurrencyConverter()
+currency_converter = CurrencyConverter(os.getenv('CURRENCY_RATES_FILE'), float(os.getenv('CURRENCY_RELOAD_SECONDS', '5')))
+search_cache = SearchResultCache(int(os.getenv('SEARCH_CACHE_SIZE', '1024')), float(os.getenv('SEARCH_CACHE_TTL', '300')))
+mongo_db.catalog_listeners.append(search_cache.invalidate)
+suggestions = SuggestionIndex(limit=int(os.getenv('SUGGEST_LIMIT', '8')))
+mongo_db.catalog_listeners.append(suggestions.mark_dirty)
+
+def suggestion_sources():
+    # Searched queries outrank keywords, which outrank product names
+    index = mongo_db.index
+    for doc_id, product in enumerate(index.docs):
+        if doc_id not in index.deleted:
+            yield product['name'], 1.0
+    for keywords in semantic_ai.semantic_mappings.values():
+        for keyword in keywords:
+            yield keyword, 2.0
+    for query, count in mongo_db.analytics.popular_queries(int(os.getenv('SUGGEST_HISTORY_LIMIT', '5000'))):
+        yield query, 3.0 * count
+
+suggestions.build(suggestion_sources())
+suggestions.start_refresh(suggestion_sources, float(os.getenv('SUGGEST_REFRESH_SECONDS', '30')))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler_ident = profiler.start() if profiler else None
+
+@app.after_request
+def observe_request(response):
+    # Observed when the body has been sent, so streamed results are included
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, response.status_code
+    started, profiler_ident = g.request_started, g.profiler_ident
+    query = request.query_string.decode('utf-8', 'replace')
+    
+    def finish():
+        seconds = time.perf_counter() - started
+        metrics.observe('http_request_seconds', seconds, route=route, method=method, status=status)
+        if profiler_ident is not None:
+            profiler.stop(profiler_ident, f'{route} {query}', seconds)
+    
+    response.call_on_close(finish)
+    return response
 
 @app.route('/')
 def home():
@@ -240,7 +966,8 @@ def home():
             <div id="statusInfo" class="status-info"></div>
             
             <div class="search-box">
-                <input type="text" id="searchInput" class="search-input" placeholder="Search: iPhone, laptop, headphones...">
+                <input type="text" id="searchInput" class="search-input" list="suggestions" autocomplete="off" placeholder="Search: iPhone, laptop, headphones...">
+                <datalist id="suggestions"></datalist>
                 <select id="currencySelect" class="currency-select">
                     <option value="USD">USD ($)</option>
                     <option value="EUR">EUR (€)</option>
@@ -256,24 +983,76 @@ def home():
                 <button onclick="addData()" class="add-btn">Add Data</button>
             </div>
             <div id="results" class="results"></div>
+            <div id="scrollSentinel"></div>
         </div>
     </div>
 
     <script>
+        let currentQuery = '';
+        let currentCurrency = 'USD';
+        let nextCursor = null;
+        let loadingPage = false;
+        
         function search() {
             const query = document.getElementById('searchInput').value.trim();
             const currency = document.getElementById('currencySelect').value;
             if (!query) return;
             
+            currentQuery = query;
+            currentCurrency = currency;
+            nextCursor = null;
             document.getElementById('results').innerHTML = '<div style="text-align:center;padding:40px;">Searching...</div>';
+            loadPage(query, currency, null);
+        }
+        
+        function loadPage(query, currency, cursor) {
+            loadingPage = true;
+            let url = `/search?q=${encodeURIComponent(query)}&currency=${currency}`;
+            if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
             
-            fetch(`/search?q=${encodeURIComponent(query)}&currency=${currency}`)
-                .then(response => response.text())
-                .then(html => {
-                    document.getElementById('results').innerHTML = html;
+            fetch(url)
+                .then(async response => {
+                    if (query !== currentQuery) return;
+                    nextCursor = response.headers.get('X-Next-Cursor');
+                    const resultsDiv = document.getElementById('results');
+                    if (!cursor) resultsDiv.innerHTML = '';
+                    // Each page streams into its own container; display: contents keeps its cards in the grid
+                    const pageDiv = document.createElement('div');
+                    pageDiv.style.display = 'contents';
+                    resultsDiv.appendChild(pageDiv);
+                    
+                    // Render product cards as the server streams them
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let html = '';
+                    while (true) {
+                        const { done, value } = await reader.read();
+                        if (done) break;
+                        html += decoder.decode(value, { stream: true });
+                        pageDiv.innerHTML = html;
+                    }
+                    pageDiv.innerHTML = html + decoder.decode();
+                })
+                // A failed page ends the scroll rather than being retried in a loop below
+                .catch(() => { if (query === currentQuery) nextCursor = null; })
+                .finally(() => {
+                    loadingPage = false;
+                    // The observer only fires on changes; a short page can leave the sentinel in
+                    // view, so observing it again reports its current state and loads the next page
+                    scrollObserver.unobserve(scrollSentinel);
+                    scrollObserver.observe(scrollSentinel);
                 });
         }
         
+        // Infinite scroll: the next page is requested as the end of the results comes into view
+        const scrollSentinel = document.getElementById('scrollSentinel');
+        const scrollObserver = new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting && nextCursor && !loadingPage) {
+                loadPage(currentQuery, currentCurrency, nextCursor);
+            }
+        }, { rootMargin: '400px' });
+        scrollObserver.observe(scrollSentinel);
+        
         function getAIRecommendation() {
             const query = document.getElementById('searchInput').value.trim();
             if (!query) return;
@@ -321,6 +1100,31 @@ def home():
         document.getElementById('searchInput').addEventListener('keypress', function(e) {
             if (e.key === 'Enter') search();
         });
+        
+        // Debounced so a burst of keystrokes sends one request; a newer one cancels the last
+        let suggestTimer = null;
+        let suggestRequest = null;
+        document.getElementById('searchInput').addEventListener('input', function(e) {
+            clearTimeout(suggestTimer);
+            const prefix = e.target.value.trim();
+            if (!prefix) return;
+            suggestTimer = setTimeout(() => {
+                if (suggestRequest) suggestRequest.abort();
+                suggestRequest = new AbortController();
+                fetch('/suggest?q=' + encodeURIComponent(prefix), { signal: suggestRequest.signal })
+                    .then(response => response.json())
+                    .then(data => {
+                        const list = document.getElementById('suggestions');
+                        list.innerHTML = '';
+                        data.suggestions.forEach(text => {
+                            const option = document.createElement('option');
+                            option.value = text;
+                            list.appendChild(option);
+                        });
+                    })
+                    .catch(() => {});
+            }, 150);
+        });
     </script>
 </body>
 </html>
@@ -328,91 +1132,184 @@ def home():
 
 @app.route('/search')
 def search():
-    query = request.args.get('q', '').strip()
-    currency = request.args.get('currency', 'USD')
-    if not query:
+    params = parse_search_params(request.args)
+    if not params['query']:
         return '<div>Please enter a search term</div>'
     
-    semantic_data = semantic_ai.extract_semantic_meaning(query)
-    quality = semantic_data['quality']
+    if request.args.get('explain'):
+        plan = mongo_db.plan_search(semantic_ai.extract_semantic_meaning(params['query']))
+        return jsonify(mongo_db.explain_search(params['query'], plan, params['semantic_weight'], params['sort'], params['page_size']))
+    try:
+        search = start_search(params)
+    except ValueError as e:
+        return {'error': str(e)}, 400
     
-    results = []
+    try:
+        page = rank_query(params['query'], params['semantic_weight'], search['plan'], params['sort'], params['page_size'],
+                          search['position'], params['cursor'])
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    next_cursor, headers = finish_search(params, search, page)
+    first_page = search['position'] is None
+    # External sources are only listed on the first page
+    results = build_results(params['query'], page, params['currency'],
+                            search['semantic_data']['quality'] if first_page else None, external=first_page)
     
-    # Search MongoDB or use fallback
-    if mongo_db.connected:
-        db_results = mongo_db.search_products(query)
-        mongo_db.log_search(query, len(db_results))
-        
-        for product in db_results:
-            converted_price = currency_converter.convert_price(product['price'], currency)
-            results.append({
-                'name': product['name'],
-                'desc': product['description'],
-                'price': converted_price,
-                'source': 'MongoDB Atlas',
-                'url': f"https://www.google.com/search?q={query.replace(' ', '+')}+{product['name'].replace(' ', '+')}",
-                'is_db': True
-            })
-    else:
-        # Fallback data
-        mock_products = [
-            {"name": "iPhone 15 Pro Max", "description": "Latest Apple smartphone", "price": 1199},
-            {"name": "MacBook Pro M3", "description": "Professional laptop", "price": 1999},
-            {"name": "Sony WH-1000XM5", "description": "Noise canceling headphones", "price": 399}
-        ]
-        
-        for product in mock_products:
-            if query.lower() in product['name'].lower():
-                converted_price = currency_converter.convert_price(product['price'], currency)
-                results.append({
-                    'name': product['name'],
-                    'desc': product['description'],
-                    'price': converted_price,
-                    'source': 'Local Database',
-                    'url': f"https://www.google.com/search?q={query.replace(' ', '+')}",
-                    'is_db': True
-                })
+    if params['format'] == 'json':
+        payload = search_cache.renderings.get(search['rendering_key'])
+        if payload is None:
+            with metrics.timed('render'):
+                payload = search_payload(params, page, next_cursor, list(results))
+            search_cache.renderings.set(search['rendering_key'], payload)
+        return jsonify(payload), 200, headers
     
-    # Add external results
-    external_sources = [
-        ('Google', f'https://www.google.com/search?tbm=shop&q={query.replace(" ", "+")}'),
-        ('Amazon', f'https://www.amazon.com/s?k={query.replace(" ", "+")}'),
-        ('Bing', f'https://www.bing.com/search?q={query.replace(" ", "+")}+buy')
-    ]
+    html = search_cache.renderings.get(search['rendering_key'])
+    if html is not None:
+        return html, 200, headers
+    return Response(stream_and_cache(search['rendering_key'], RESULTS_TEMPLATE.generate(results=results)),
+                    mimetype='text/html', headers=headers)
+
+def parse_search_params(args):
+    # args maps each parameter to one string; shared by the Flask view and the ASGI endpoint
+    def number(name, convert, default):
+        try:
+            return convert(args.get(name, default))
+        except (TypeError, ValueError):
+            return default
     
-    for source, url in external_sources:
-        price_ranges = {'premium_quality': (600, 1500), 'mid_range': (200, 600), 'budget_friendly': (50, 200)}
-        price_min, price_max = price_ranges.get(quality, (100, 500))
-        
-        usd_price = random.randint(price_min, price_max) + 0.99
-        converted_price = currency_converter.convert_price(usd_price, currency)
-        
-        results.append({
-            'name': f'{query} - {source} Result',
-            'desc': f'External result from {source}',
-            'price': converted_price,
-            'source': source,
-            'url': url,
-            'is_db': False
-        })
-    
-    # Generate HTML
-    html = ''
-    for product in results:
-        badge_class = 'db-badge' if product.get('is_db') else 'source-badge'
-        html += f'''
-        <div class="product">
-            <div class="product-name">{product['name']}</div>
-            <div class="product-desc">{product['desc']}</div>
-            <div class="product-footer">
-                <div class="product-price">{product['price']}</div>
-                <span class="{badge_class}">{product['source']}</span>
-                <a href="{product['url']}" target="_blank" class="visit-btn">Visit</a>
-            </div>
-        </div>
-        '''
+    return {
+        'query': args.get('q', '').strip(),
+        'currency': args.get('currency', 'USD'),
+        'semantic_weight': clamp_semantic_weight(number('semantic', float, SEMANTIC_WEIGHT)),
+        'sort': args.get('sort', 'relevance'),
+        'page_size': clamp_page_size(number('page_size', int, SEARCH_PAGE_SIZE)),
+        'cursor': args.get('cursor') or None,
+        'format': 'json' if args.get('format') == 'json' else 'html'
+    }
+
+def start_search(params):
+    # Plan, cursor position and rendering cache key; ValueError for a cursor that does
+    # not belong to this search
+    currency_converter.maybe_reload()
+    query = normalize_query(params['query'])
+    semantic_data = semantic_ai.extract_semantic_meaning(params['query'])
+    plan = mongo_db.plan_search(semantic_data)
+    fingerprint = cursor_fingerprint(query, params['semantic_weight'], params['sort'], plan.facets)
+    position = decode_cursor(params['cursor'], fingerprint) if params['cursor'] else None
+    # Read before ranking, like the ranking key: a page rendered from an older catalog can
+    # be written back after the invalidation, but never under a key that is still looked up
+    rendering_key = (query, params['semantic_weight'], params['currency'], params['sort'], currency_converter.version,
+                     params['page_size'], params['cursor'], params['format'], mongo_db.catalog_generation)
+    return {
+        'semantic_data': semantic_data,
+        'plan': plan,
+        'fingerprint': fingerprint,
+        'position': position,
+        'rendering_key': rendering_key
+    }
+
+def finish_search(params, search, page):
+    # Later pages are the same search scrolled further, not new searches
+    if search['position'] is None:
+        mongo_db.log_search(params['query'], len(page['doc_ids']), search['semantic_data'])
+        if page['doc_ids']:
+            suggestions.record(params['query'], 3.0)
+    next_cursor = encode_cursor(page['next'], search['fingerprint']) if page['next'] else None
+    return next_cursor, page_headers(page, next_cursor)
+
+def search_payload(params, page, next_cursor, results):
+    return {
+        'query': params['query'],
+        'currency': params['currency'],
+        'results': results,
+        'page_size': params['page_size'],
+        'next_cursor': next_cursor,
+        'total_hits': page['total'],
+        'total_hits_relation': page['total_relation']
+    }
+
+def clamp_page_size(page_size):
+    return min(max(page_size or SEARCH_PAGE_SIZE, 1), SEARCH_MAX_PAGE_SIZE)
+
+def clamp_semantic_weight(weight):
+    # float() accepts "nan" and "inf"; a NaN weight would blend every score into NaN
+    return min(max(weight, 0.0), 1.0) if math.isfinite(weight) else SEMANTIC_WEIGHT
+
+def page_headers(page, next_cursor):
+    # HTML pages stream, so paging metadata travels in headers
+    headers = {'X-Total-Hits': str(page['total']), 'X-Total-Hits-Relation': page['total_relation']}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return headers
+
+@app.route('/suggest')
+def suggest():
+    prefix = request.args.get('q', '')
+    return {'query': prefix, 'suggestions': suggestions.suggest(prefix, request.args.get('limit', type=int))}
+
+def rank_query(query, semantic_weight, plan, sort='relevance', page_size=SEARCH_PAGE_SIZE, position=None, cursor=None):
+    # Search the index (built from MongoDB, or from fallback data when disconnected). The
+    # generation keeps a page ranked before a catalog change from outliving it, even if
+    # the change lands between the ranking and its cache write
+    ranking_key = (normalize_query(query), semantic_weight, sort, page_size, cursor, mongo_db.catalog_generation)
+    page = search_cache.rankings.get(ranking_key)
+    if page is None:
+        page = mongo_db.search_page(query, page_size, semantic_weight, plan, sort, position)
+        search_cache.rankings.set(ranking_key, page)
+    return page
+
+def stream_and_cache(rendering_key, chunks):
+    # Render time excludes the time spent waiting on the client between chunks
+    parts = []
+    rendering = 0.0
+    chunks = iter(chunks)
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        rendering += time.perf_counter() - started
+        if chunk is None:
+            break
+        parts.append(chunk)
+        yield chunk
+    metrics.observe('search_stage_seconds', rendering, stage='render')
+    search_cache.renderings.set(rendering_key, ''.join(parts))
+
+def build_results(query, page, currency, quality, external=True):
+    # Yields results in ranked order so cards can be sent as soon as they are ready
+    yield from db_results(query, page, currency)
+    if external:
+        for source, url_template in EXTERNAL_SOURCES:
+            yield external_result(source, url_template, query, quality, currency)
+
+def db_results(query, page, currency):
+    source_name = 'MongoDB Atlas' if mongo_db.connected else 'Local Database'
+    query_param = quote_plus(query)
+    # Rendered from the index the page was ranked against; streamed HTML gets here after
+    # the view has returned, when a rebuild may have swapped in another one
+    products = mongo_db.get_products(page['doc_ids'], page['docs'])
+    prices = currency_converter.format_prices([product['price'] for product in products], currency)
     
-    return html
+    for product, price in zip(products, prices):
+        yield {
+            'name': product['name'],
+            'desc': product['description'],
+            'price': price,
+            'source': source_name,
+            'url': f"https://www.google.com/search?q={query_param}+{quote_plus(product['name'])}",
+            'is_db': True
+        }
+
+def external_result(source, url_template, query, quality, currency):
+    price_min, price_max = EXTERNAL_PRICE_RANGES.get(quality, (100, 500))
+    usd_price = random.randint(price_min, price_max) + 0.99
+    return {
+        'name': f'{query} - {source} Result',
+        'desc': f'External result from {source}',
+        'price': currency_converter.convert_price(usd_price, currency),
+        'source': source,
+        'url': url_template.format(query=quote_plus(query)),
+        'is_db': False
+    }
 
 @app.route('/ai-recommend')
 def ai_recommend():
@@ -426,12 +1323,54 @@ def ai_recommend():
 
 @app.route('/status')
 def status():
+    with mongo_db.index_lock.read():
+        index_stats, embedding_stats = mongo_db.index.stats(), mongo_db.embeddings.stats()
     return {
         'connected': mongo_db.connected,
         'product_count': mongo_db.get_product_count(),
-        'error': getattr(mongo_db, 'error', None) if not mongo_db.connected else None
+        'index': index_stats,
+        'embeddings': embedding_stats,
+        'cache': search_cache.stats(),
+        'suggestions': suggestions.stats(),
+        'shards': mongo_db.shards.stats() if mongo_db.shards else None,
+        'search_log': mongo_db.search_log.stats(),
+        'analytics': mongo_db.analytics.stats(),
+        'currency': currency_converter.stats(),
+        'connection': mongo_db.connection_stats(),
+        'error': mongo_db.error if not mongo_db.connected else None
     }
 
+@app.route('/analytics')
+def search_analytics():
+    # Precomputed by the rollup flush; never scans search_history
+    granularity = request.args.get('granularity', 'hour')
+    snapshot = mongo_db.analytics.snapshot(granularity)
+    if snapshot is None:
+        return {'error': 'granularity must be hour or day'}, 400
+    return snapshot
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    if not mongo_db.connected:
+        return {'error': 'MongoDB connection failed. Check your .env file.'}, 503
+    
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    file_format = request.args.get('format') or ingestion.detect_format(upload.filename if upload else '')
+    batch_size = request.args.get('batch_size', ingestion.DEFAULT_BATCH_SIZE, type=int)
+    
+    # Upserts match on product_id; without its unique index each one scans the collection
+    mongo_db.setup_indexes()
+    try:
+        rows = ingestion.read_rows(io.TextIOWrapper(stream, encoding='utf-8'), file_format)
+        return ingestion.ingest(rows, mongo_db, semantic_ai, batch_size=batch_size)
+    except Exception as e:
+        return {'error': str(e)}, 400
+
 @app.route('/add-data')
 def add_data():
     if not mongo_db.connected:
@@ -464,10 +1403,10 @@ def add_data():
 
 if __name__ == '__main__':
     print('Starting AI-Assisted Semantic Search Engine on http://localhost:5000')
-    if mongo_db.connected:
+    if mongo_db.wait_until_connected(timeout=5):
         print('MongoDB connected successfully')
         print(f'Products in database: {mongo_db.get_product_count()}')
     else:
-        print('MongoDB connection failed - using fallback data')
+        print('MongoDB not reachable yet - using fallback data and retrying in the background')
     app.run(debug=True, port=5000)
 
@@ -0,0 +1,123 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    EXTERNAL_SOURCES, RESULTS_TEMPLATE, app, db_results, external_result, finish_search, metrics, mongo_db,
+    parse_search_params, rank_query, search_cache, search_payload, start_search
+)
+
+# Blocking PyMongo and NumPy work runs on this pool; the event loop only coordinates
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASYNC_THREADS', '32')), thread_name_prefix='search')
+EXTERNAL_SOURCE_TIMEOUT = float(os.getenv('EXTERNAL_SOURCE_TIMEOUT', '1.5'))
+
+flask_app = WsgiToAsgi(app)
+
+
+def run_blocking(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+async def fetch_external(source, url_template, query, quality, currency):
+    try:
+        return await asyncio.wait_for(
+            run_blocking(external_result, source, url_template, query, quality, currency),
+            EXTERNAL_SOURCE_TIMEOUT
+        )
+    except Exception:
+        # A slow or failing source is left out rather than holding up the page
+        return None
+
+
+async def search(args):
+    params = parse_search_params(args)
+    if not params['query']:
+        return 200, 'text/html', '<div>Please enter a search term</div>', {}
+    try:
+        search = start_search(params)
+    except ValueError as e:
+        return 400, 'application/json', json.dumps({'error': str(e)}), {}
+    rank = run_blocking(rank_query, params['query'], params['semantic_weight'], search['plan'], params['sort'],
+                        params['page_size'], search['position'], params['cursor'])
+
+    cached = search_cache.renderings.get(search['rendering_key'])
+    # DB retrieval and every external source run concurrently; sources only join the first page
+    sources = EXTERNAL_SOURCES if search['position'] is None and cached is None else []
+    try:
+        page, *external = await asyncio.gather(rank, *(
+            fetch_external(source, url_template, params['query'], search['semantic_data']['quality'], params['currency'])
+            for source, url_template in sources
+        ))
+    except ValueError as e:
+        # The cursor's stage or mode does not exist for the current plan
+        return 400, 'application/json', json.dumps({'error': str(e)}), {}
+    next_cursor, headers = finish_search(params, search, page)
+    if cached is not None:
+        return (200, *render(params['format'], cached), headers)
+
+    with metrics.timed('render'):
+        results = list(db_results(params['query'], page, params['currency'])) + [result for result in external if result is not None]
+        if params['format'] == 'json':
+            body = search_payload(params, page, next_cursor, results)
+        else:
+            body = RESULTS_TEMPLATE.render(results=results)
+    search_cache.renderings.set(search['rendering_key'], body)
+    return (200, *render(params['format'], body), headers)
+
+
+def render(response_format, body):
+    if response_format == 'json':
+        return 'application/json', json.dumps(body)
+    return 'text/html', body
+
+
+async def send_response(send, content_type, body, status=200, headers=None):
+    payload = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', f'{content_type}; charset=utf-8'.encode()), (b'content-length', str(len(payload)).encode())]
+                   + [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            mongo_db.search_log.close()
+            mongo_db.analytics.close()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    # /search is served natively; every other route (and explain mode) goes through Flask
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['path'] == '/search' and scope['method'] == 'GET':
+        # First value per name, as Flask's request.args.get gives it
+        args = {name: values[0] for name, values in parse_qs(scope.get('query_string', b'').decode('utf-8')).items()}
+        if 'explain' not in args:
+            started = time.perf_counter()
+            status, content_type, body, headers = await search(args)
+            await send_response(send, content_type, body, status, headers)
+            metrics.observe('http_request_seconds', time.perf_counter() - started, route='/search', method='GET', status=status)
+            return
+    await flask_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:application', host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', '5000')),
+                workers=int(os.getenv('WEB_CONCURRENCY', '4')))
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+DEFAULT_SIZES = '10000,100000,1000000'
+
+BRANDS = ['Apple', 'Samsung', 'Sony', 'Dell', 'Lenovo', 'Acer', 'Bose', 'Google', 'Asus', 'HP', 'JBL', 'Xiaomi']
+PRODUCT_TYPES = {
+    'mobile_device': ['Smartphone', 'Phone', 'Android Phone', 'Cell Phone'],
+    'computer': ['Laptop', 'Notebook', 'Ultrabook', 'Workstation', 'Gaming Laptop'],
+    'audio_device': ['Headphones', 'Earbuds', 'Headset', 'Speakers', 'Soundbar']
+}
+QUALITY_PRICES = {'premium_quality': (600, 2500), 'mid_range': (200, 600), 'budget_friendly': (20, 200)}
+QUALITY_WORDS = {'premium_quality': 'premium', 'mid_range': 'decent', 'budget_friendly': 'cheap'}
+USE_CASE_WORDS = ['for gaming', 'for work', 'for travel', 'for running', 'for photography', 'for music', '']
+
+
+def generate_catalog(size, seed=0):
+    rng = random.Random(seed)
+    for i in range(size):
+        category = rng.choice(list(PRODUCT_TYPES))
+        quality = rng.choice(list(QUALITY_PRICES))
+        brand = rng.choice(BRANDS)
+        kind = rng.choice(PRODUCT_TYPES[category])
+        low, high = QUALITY_PRICES[quality]
+        yield {
+            'product_id': f'P{i:08d}',
+            'name': f'{brand} {kind} {rng.randint(1, 999)}',
+            'description': f'{QUALITY_WORDS[quality].title()} {kind.lower()} {rng.choice(USE_CASE_WORDS)}'.strip(),
+            'category': category,
+            'quality': quality,
+            'price': round(rng.uniform(low, high), 2)
+        }
+
+
+def generate_queries(count, seed=1):
+    # Facet mix: plain keywords, quality + category, price constraints, intents, and misses
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        category = rng.choice(list(PRODUCT_TYPES))
+        kind = rng.choice(PRODUCT_TYPES[category]).lower()
+        roll = rng.random()
+        if roll < 0.35:
+            query = f'{rng.choice(BRANDS)} {kind}'
+        elif roll < 0.60:
+            query = f'{QUALITY_WORDS[rng.choice(list(QUALITY_WORDS))]} {kind}'
+        elif roll < 0.75:
+            query = f'{kind} under ${rng.choice([100, 300, 500, 1000])}'
+        elif roll < 0.90:
+            query = f'{rng.choice(["recommend", "compare", "looking for"])} {kind} {rng.choice(USE_CASE_WORDS)}'.strip()
+        else:
+            query = f'zx{rng.randint(0, 10 ** 6)} gadget'
+        queries.append(query)
+    return queries
+
+
+class KeyedUpsertManager:
+    # mongomock answers upserts with a full scan; this keeps the ingestion benchmark
+    # about the pipeline by resolving product_id upserts through a dict, as Mongo's
+    # unique index would, then indexing the batch as MongoDBManager.upsert_products does
+    def __init__(self, manager):
+        self.manager = manager
+        self.documents = {}
+
+    def upsert_products(self, products):
+        if not products:
+            return None
+        for product in products:
+            key = product['product_id']
+            self.documents[key] = {**self.documents.get(key, {}), **product}
+        self.manager.index_products(products)
+        return len(products)
+
+
+def latency_stats(latencies, elapsed):
+    samples = np.asarray(latencies) * 1000.0
+    return {
+        'count': len(latencies),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+        'mean_ms': round(float(samples.mean()), 4),
+        'throughput_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    }
+
+
+def measure(fn, items):
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - t0)
+    return latency_stats(latencies, time.perf_counter() - started)
+
+
+async def asgi_get(application, path, params):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': urlencode(params).encode(), 'root_path': '',
+        'headers': [], 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80)
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages
+
+
+def measure_concurrent(application, path, queries, concurrency, extra_params=None):
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(query):
+            async with limit:
+                t0 = time.perf_counter()
+                await asgi_get(application, path, {'q': query, **(extra_params or {})})
+                latencies.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(query) for query in queries))
+        return latency_stats(latencies, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def peak_memory_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_size(size, query_count, ingest_rows, concurrency, shards=0):
+    # Runs in its own process so peak memory is per catalog size
+    os.environ['MONGODB_URI'] = 'mongomock://benchmark'
+    os.environ.setdefault('SEARCH_LOG_SPOOL', '')
+    # generate_queries repeats queries; with the result cache on, the routes would
+    # mostly measure cache hits. SEARCH_CACHE_SIZE=1024 measures with it instead
+    os.environ.setdefault('SEARCH_CACHE_SIZE', '0')
+    pool = None
+    if shards:
+        # Forked before the app import starts the driver, health and writer threads
+        from shard_pool import ShardPool
+        pool = ShardPool(shards)
+    import app as search_app
+    import ingestion
+
+    mongo_db = search_app.mongo_db
+    mongo_db.wait_until_connected()
+    result = {'catalog_size': size, 'backend': 'mongomock'}
+
+    started = time.perf_counter()
+    batch = []
+    for product in generate_catalog(size):
+        batch.append(product)
+        if len(batch) >= 10000:
+            mongo_db.products.insert_many(batch)
+            batch = []
+    if batch:
+        mongo_db.products.insert_many(batch)
+    result['load_seconds'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    mongo_db.build_index()
+    result['index_build_seconds'] = round(time.perf_counter() - started, 3)
+    result['index'] = mongo_db.index.stats()
+    result['embeddings'] = mongo_db.embeddings.stats()
+
+    queries = generate_queries(query_count)
+    semantic_ai = search_app.semantic_ai
+
+    def search_products(query):
+        plan = mongo_db.plan_search(semantic_ai.extract_semantic_meaning(query))
+        mongo_db.search_page(query, plan=plan)
+
+    client = search_app.app.test_client()
+    scenarios = {
+        'semantic_extract': semantic_ai.extract_semantic_meaning,
+        'search_products': search_products,
+        'search_route': lambda q: client.get('/search', query_string={'q': q}).get_data(),
+        'search_route_json': lambda q: client.get('/search', query_string={'q': q, 'format': 'json', 'currency': 'EUR'}).get_data(),
+        'ai_recommend_route': lambda q: client.get('/ai-recommend', query_string={'q': q}).get_data()
+    }
+    result['paths'] = {}
+    for path, fn in scenarios.items():
+        # Every scenario starts cold, never on pages an earlier one left cached
+        search_app.search_cache.invalidate()
+        result['paths'][path] = measure(fn, queries)
+    search_app.search_cache.invalidate()
+    import asgi
+    result['paths']['asgi_search_concurrent'] = measure_concurrent(
+        asgi.application, '/search', queries, concurrency, {'format': 'json'}
+    )
+    result['concurrency'] = concurrency
+    if pool is not None:
+        # Same queries ranked by worker processes; compare with search_products
+        mongo_db.shards = pool
+        mongo_db.start_shard_sync()
+        result['paths']['search_products_sharded'] = measure(search_products, queries)
+        result['shards'] = mongo_db.shards.stats()
+        mongo_db.shards.close()
+    result['cache'] = search_app.search_cache.stats()
+
+    rows = ({**product, 'product_id': f'I{i:08d}'} for i, product in enumerate(generate_catalog(ingest_rows, seed=2)))
+    stats = ingestion.ingest(rows, KeyedUpsertManager(mongo_db), semantic_ai, batch_size=1000)
+    result['ingestion'] = {'rows': stats['written'], 'seconds': stats['seconds'], 'rows_per_second': stats['rows_per_second']}
+
+    mongo_db.search_log.close()
+    result['peak_memory_mb'] = peak_memory_mb()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {run['catalog_size']: run for run in json.load(f)['runs']}
+    for run in results['runs']:
+        previous = baseline.get(run['catalog_size'])
+        if not previous:
+            continue
+        for path, stats in run['paths'].items():
+            before = previous['paths'].get(path, {}).get('p95_ms')
+            if before:
+                change = (stats['p95_ms'] - before) / before * 100
+                print(f"{run['catalog_size']:>9} {path:<20} p95 {before:.3f} -> {stats['p95_ms']:.3f} ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark search, AI-recommend and ingestion paths on synthetic catalogs')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated catalog sizes')
+    parser.add_argument('--queries', type=int, default=2000, help='queries per path')
+    parser.add_argument('--ingest-rows', type=int, default=50000)
+    parser.add_argument('--concurrency', type=int, default=100, help='in-flight requests for the ASGI scenario')
+    parser.add_argument('--shards', type=int, default=0, help='also measure ranking on this many worker processes')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='previous results file to compare p95 latencies against')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_size:
+        print(json.dumps(run_size(args.run_size, args.queries, args.ingest_rows, args.concurrency, args.shards)))
+        return 0
+
+    runs = []
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        print(f'Benchmarking {size:,} products...', file=sys.stderr)
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--run-size', str(size),
+            '--queries', str(args.queries), '--ingest-rows', str(args.ingest_rows),
+            '--concurrency', str(args.concurrency), '--shards', str(args.shards)
+        ], text=True)
+        run = json.loads(output.strip().splitlines()[-1])
+        runs.append(run)
+        for path, stats in run['paths'].items():
+            print(f"  {path:<20} p50 {stats['p50_ms']:.3f} ms  p95 {stats['p95_ms']:.3f} ms  "
+                  f"p99 {stats['p99_ms']:.3f} ms  {stats['throughput_per_second']:,.0f}/s", file=sys.stderr)
+        print(f"  ingestion {run['ingestion']['rows_per_second']:,.0f} rows/s, peak memory {run['peak_memory_mb']} MB", file=sys.stderr)
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'queries_per_path': args.queries,
+        'runs': runs
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}', file=sys.stderr)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import random
+import threading
+import time
+
+from pymongo.monitoring import ConnectionPoolListener
+
+
+class CircuitBreaker:
+    # closed: calls go through; open: calls fail fast until reset_timeout has passed;
+    # half_open: one trial call decides whether to close again or re-open
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'rejected': self.rejected
+        }
+
+
+class HealthMonitor:
+    # Pings in the background; while the target is down, retries back off exponentially
+    def __init__(self, ping, on_up=None, on_down=None, interval=15.0, backoff_base=0.5, backoff_max=60.0):
+        self.ping = ping
+        self.on_up = on_up
+        self.on_down = on_down
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.healthy = False
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_latency_ms = None
+        self.last_check = None
+        self.next_delay = 0.0
+        self.check_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='mongodb-health', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.check()
+            self.stop_event.wait(self.next_delay)
+
+    def check(self):
+        with self.check_lock:
+            started = time.perf_counter()
+            try:
+                self.ping()
+            except Exception as e:
+                self.last_error = str(e)
+                self.consecutive_failures += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self.consecutive_failures - 1))
+                self.next_delay = delay * random.uniform(0.5, 1.0)
+                was_healthy, self.healthy = self.healthy, False
+                if was_healthy and self.on_down:
+                    self.on_down()
+                return False
+            finally:
+                self.last_check = time.time()
+
+            self.last_latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.consecutive_failures = 0
+            self.last_error = None
+            self.next_delay = self.interval
+            was_healthy, self.healthy = self.healthy, True
+            if not was_healthy and self.on_up:
+                self.on_up()
+            return True
+
+    def stats(self):
+        return {
+            'healthy': self.healthy,
+            'consecutive_failures': self.consecutive_failures,
+            'last_latency_ms': self.last_latency_ms,
+            'last_check': self.last_check,
+            'next_check_seconds': round(self.next_delay, 2),
+            'last_error': self.last_error
+        }
+
+
+class PoolStats(ConnectionPoolListener):
+    # Connection pool counters fed by PyMongo's monitoring events
+    def __init__(self):
+        self.open_connections = 0
+        self.checked_out = 0
+        self.check_out_failures = 0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def stats(self):
+        return {
+            'open_connections': self.open_connections,
+            'checked_out': self.checked_out,
+            'check_out_failures': self.check_out_failures,
+            'pool_clears': self.pool_clears
+        }
@@ -0,0 +1,164 @@
+import time
+import zlib
+import numpy as np
+
+EMBEDDING_FIELDS = ('name', 'description', 'category')
+
+
+def product_text(product):
+    return ' '.join(str(product.get(field) or '') for field in EMBEDDING_FIELDS).replace('_', ' ')
+
+
+class HashedNgramVectorizer:
+    # Character n-grams hashed into a fixed number of buckets; needs no training or GPU
+    def __init__(self, dims=512, ngram_range=(3, 4)):
+        self.dims = dims
+        self.ngram_range = ngram_range
+
+    def _buckets(self, text):
+        buckets = []
+        low, high = self.ngram_range
+        for word in text.lower().split():
+            padded = f' {word} '
+            for n in range(low, high + 1):
+                for i in range(max(len(padded) - n + 1, 1)):
+                    buckets.append(zlib.crc32(padded[i:i + n].encode('utf-8')) % self.dims)
+        return buckets
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = self._buckets(text)
+            if buckets:
+                vectors[row] = np.log1p(np.bincount(buckets, minlength=self.dims))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+        return vectors
+
+
+class IVFQuantizer:
+    # Coarse k-means quantizer: queries only score rows in the nprobe closest lists
+    def __init__(self, n_lists, n_probe=8, iterations=10, sample_size=50000):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.centroids = None
+        self.lists = []
+
+    def train(self, vectors):
+        rng = np.random.default_rng(0)
+        sample = vectors
+        if len(vectors) > self.sample_size:
+            sample = vectors[rng.choice(len(vectors), self.sample_size, replace=False)]
+        n_lists = min(self.n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[c] = centroid / norm if norm else centroid
+        self.centroids = centroids
+        self.lists = [[] for _ in range(n_lists)]
+        self.add(vectors, 0)
+
+    def add(self, vectors, first_row):
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for offset, c in enumerate(assignment):
+            self.lists[c].append(first_row + offset)
+
+    def candidates(self, query_vector):
+        probe = min(self.n_probe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query_vector), probe - 1)[:probe]
+        rows = [self.lists[c] for c in closest if self.lists[c]]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.asarray(r, dtype=np.int64) for r in rows])
+
+
+class EmbeddingIndex:
+    def __init__(self, vectorizer=None, ivf_min_rows=100000, ivf_probe=8):
+        self.vectorizer = vectorizer or HashedNgramVectorizer()
+        self.ivf_min_rows = ivf_min_rows
+        self.ivf_probe = ivf_probe
+        self.clear()
+
+    def clear(self):
+        self.matrix = np.zeros((0, self.vectorizer.dims), dtype=np.float32)
+        self.size = 0
+        self.ivf = None
+        self.build_seconds = 0.0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vectors(self):
+        return self.matrix[:self.size]
+
+    def build(self, products, batch_size=4096):
+        started = time.perf_counter()
+        self.clear()
+        batch = []
+        for product in products:
+            batch.append(product_text(product))
+            if len(batch) >= batch_size:
+                self._append(self.vectorizer.encode(batch))
+                batch = []
+        if batch:
+            self._append(self.vectorizer.encode(batch))
+        if self.size >= self.ivf_min_rows:
+            self.ivf = IVFQuantizer(int(np.sqrt(self.size)), self.ivf_probe)
+            self.ivf.train(self.vectors)
+        self.build_seconds = time.perf_counter() - started
+        return self.size
+
+    def add_many(self, products, vectors=None):
+        first_row = self.size
+        if vectors is None:
+            vectors = self.vectorizer.encode([product_text(product) for product in products])
+        self._append(vectors)
+        if self.ivf is not None:
+            self.ivf.add(vectors, first_row)
+        return first_row
+
+    def remove(self, row):
+        # A zero vector scores 0 against every query, which takes the row out of results
+        if row < self.size:
+            self.matrix[row] = 0.0
+
+    def _append(self, vectors):
+        needed = self.size + len(vectors)
+        if needed > len(self.matrix):
+            # Grow geometrically so incremental adds stay amortized O(1)
+            grown = np.zeros((max(needed, 2 * len(self.matrix), 64), self.vectorizer.dims), dtype=np.float32)
+            grown[:self.size] = self.vectors
+            self.matrix = grown
+        self.matrix[self.size:needed] = vectors
+        self.size = needed
+
+    def similarities(self, query, row_range=None):
+        # Rows and their cosine similarity to the query: every row in exact mode, the
+        # probed lists in IVF mode. row_range limits both to [start, end)
+        query_vector = self.vectorizer.encode([query])[0]
+        start, end = row_range or (0, self.size)
+        end = min(end, self.size)
+        if self.ivf is not None:
+            rows = self.ivf.candidates(query_vector)
+            if row_range is not None:
+                rows = rows[(rows >= start) & (rows < end)]
+            return rows, self.matrix[rows] @ query_vector
+        return np.arange(start, end), self.matrix[start:end] @ query_vector
+
+    def stats(self):
+        return {
+            'rows': self.size,
+            'dims': self.vectorizer.dims,
+            'mode': 'ivf' if self.ivf is not None else 'exact',
+            'bytes': int(self.vectors.nbytes),
+            'build_seconds': round(self.build_seconds, 4)
+        }
@@ -0,0 +1,141 @@
+import argparse
+import csv
+import hashlib
+import json
+import math
+import sys
+import time
+
+DEFAULT_BATCH_SIZE = 1000
+ID_FIELDS = ('product_id', 'id', 'sku')
+
+
+def detect_format(path):
+    return 'csv' if str(path).lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(source, file_format='jsonl'):
+    # Generator over an open text stream, so files of any size are read row by row
+    if file_format == 'csv':
+        yield from csv.DictReader(source)
+        return
+    for line in source:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def parse_price(value):
+    try:
+        if isinstance(value, (int, float)):
+            price = float(value)
+        else:
+            price = float(str(value).replace('$', '').replace(',', '').strip())
+    except (ValueError, OverflowError):
+        return None
+    # float() accepts "nan" and "inf", which would break price sorting and cursor keys
+    return price if math.isfinite(price) else None
+
+
+def normalize_product(row, semantic_ai):
+    if not isinstance(row, dict):
+        return None
+    name = str(row.get('name') or '').strip()
+    price = parse_price(row.get('price'))
+    if not name or price is None or price < 0:
+        return None
+
+    description = str(row.get('description') or '').strip()
+    product_id = next((str(row[field]).strip() for field in ID_FIELDS if row.get(field)), None)
+    if product_id is None:
+        # Stable id derived from the name so re-loading the same file upserts instead of duplicating
+        product_id = hashlib.sha1(name.lower().encode('utf-8')).hexdigest()[:16]
+
+    category = str(row.get('category') or '').strip().lower().replace(' ', '_')
+    quality = str(row.get('quality') or '').strip().lower().replace(' ', '_')
+    if category not in semantic_ai.category_types or quality not in semantic_ai.quality_types:
+        semantic_data = semantic_ai.extract_semantic_meaning(f'{name} {description}')
+        if category not in semantic_ai.category_types:
+            category = semantic_data['category'] or 'other'
+        if quality not in semantic_ai.quality_types:
+            quality = semantic_data['quality']
+
+    return {
+        'product_id': product_id,
+        'name': name,
+        'description': description,
+        'category': category,
+        'quality': quality,
+        'price': price
+    }
+
+
+def batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(rows, manager, semantic_ai, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    stats = {'read': 0, 'written': 0, 'rejected': 0}
+    started = time.perf_counter()
+
+    def normalized():
+        for row in rows:
+            stats['read'] += 1
+            product = normalize_product(row, semantic_ai)
+            if product is None:
+                stats['rejected'] += 1
+            else:
+                yield product
+
+    for batch in batched(normalized(), max(batch_size, 1)):
+        if manager.upsert_products(batch) is None:
+            raise ConnectionError('MongoDB is unavailable')
+        stats['written'] += len(batch)
+        if progress:
+            progress(stats, time.perf_counter() - started)
+
+    seconds = time.perf_counter() - started
+    stats['seconds'] = round(seconds, 3)
+    stats['rows_per_second'] = round(stats['written'] / seconds, 1) if seconds else 0.0
+    return stats
+
+
+def print_progress(stats, seconds):
+    rate = stats['written'] / seconds if seconds else 0.0
+    print(f"\r{stats['written']} written, {stats['rejected']} rejected, {rate:,.0f} rows/s", end='', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-load a JSONL or CSV product catalog into MongoDB')
+    parser.add_argument('path', help='JSONL or CSV file ("-" for stdin)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='defaults to the file extension')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from app import mongo_db, semantic_ai
+    if not mongo_db.wait_until_connected():
+        print('MongoDB connection failed. Check your .env file.', file=sys.stderr)
+        return 1
+
+    mongo_db.setup_indexes()
+    file_format = args.format or detect_format(args.path)
+    source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+    with source:
+        stats = ingest(read_rows(source, file_format), mongo_db, semantic_ai, args.batch_size, print_progress)
+    print(file=sys.stderr)
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+
+SLUG_LENGTH = 60
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+def format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Caller holds the registry lock
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+class MetricsRegistry:
+    # Histograms keyed by (metric name, label values), rendered in Prometheus text format
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, stage):
+        # Works as a context manager or as a decorator on functions and methods
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('search_stage_seconds', time.perf_counter() - started, stage=stage)
+
+    def render(self):
+        with self.lock:
+            snapshot = sorted(
+                ((name, labels, list(histogram.samples()), histogram.sum, histogram.count)
+                 for (name, labels), histogram in self.histograms.items()),
+                key=lambda item: (item[0], item[1])
+            )
+        lines = []
+        current = None
+        for name, labels, samples, total, count in snapshot:
+            if name != current:
+                current = name
+                if name in self.help:
+                    lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+            labels = dict(labels)
+            for bound, cumulative in samples:
+                lines.append(f'{name}_bucket{{{format_labels({**labels, "le": format_value(bound)})}}} {cumulative}')
+            suffix = f'{{{format_labels(labels)}}}' if labels else ''
+            lines.append(f'{name}_sum{suffix} {format_value(total)}')
+            lines.append(f'{name}_count{suffix} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def stack_frames(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class SlowRequestProfiler:
+    # Samples the stacks of in-flight request threads; requests slower than the threshold
+    # are written as collapsed stacks ("a;b;c count"), the input format of flamegraph.pl
+    # and speedscope
+    def __init__(self, threshold_ms, interval_ms=5.0, output_dir='profiles'):
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000.0
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.active = {}
+        self.thread = None
+        self.dumped = 0
+
+    def start(self):
+        ident = threading.get_ident()
+        with self.lock:
+            self.active[ident] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self.thread.start()
+        return ident
+
+    def stop(self, ident, label, seconds):
+        with self.lock:
+            stacks = self.active.pop(ident, None)
+        if stacks and seconds * 1000 >= self.threshold_ms:
+            self.dump(label, seconds, stacks)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[stack_frames(frame)] += 1
+
+    def dump(self, label, seconds, stacks):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # The label carries the raw query; keep the name well under NAME_MAX, with a hash so
+        # long queries that share a prefix still get distinct files
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')[:SLUG_LENGTH].rstrip('_') or 'request'
+        slug = f"{slug}-{zlib.crc32(label.encode('utf-8')):08x}"
+        path = os.path.join(self.output_dir, f'{int(time.time() * 1000)}-{slug}-{seconds * 1000:.0f}ms.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        self.dumped += 1
+        return path
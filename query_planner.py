@@ -0,0 +1,130 @@
+import base64
+import json
+import math
+import re
+import zlib
+
+# Fields the result renderer needs; _id and product_id map documents back to index rows
+RENDER_PROJECTION = {"product_id": 1, "name": 1, "description": 1, "category": 1, "quality": 1, "price": 1}
+
+OBJECT_ID_PATTERN = re.compile(r'[0-9a-f]{24}')
+
+# Compound indexes for facet filters: equality fields first, then the price range/sort.
+# _id breaks price ties, so search-after paging can seek straight to the next page
+FACET_INDEXES = [
+    [("category", 1), ("quality", 1), ("price", 1), ("_id", 1)],
+    [("category", 1), ("price", 1), ("_id", 1)],
+    [("quality", 1), ("price", 1), ("_id", 1)],
+    [("price", 1), ("_id", 1)]
+]
+
+
+def index_name(keys):
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+
+class QueryPlan:
+    def __init__(self, category=None, quality=None, max_price=None):
+        self.category = category
+        self.quality = quality
+        self.max_price = max_price
+
+    def without_quality(self):
+        if self.quality is None:
+            return None
+        return QueryPlan(self.category, None, self.max_price)
+
+    @property
+    def facets(self):
+        facets = {'category': self.category, 'quality': self.quality, 'max_price': self.max_price}
+        return {field: value for field, value in facets.items() if value is not None}
+
+    def mongo_filter(self, after=None, descending=False):
+        query = {}
+        if self.category is not None:
+            query['category'] = self.category
+        if self.quality is not None:
+            query['quality'] = self.quality
+        if self.max_price is not None:
+            query['price'] = {'$lt': self.max_price}
+        if after is not None:
+            # Search-after on the (price, _id) sort key of the previous page's last document
+            price, object_id = after
+            beyond = '$lt' if descending else '$gt'
+            seek = {'$or': [{'price': {beyond: price}}, {'price': price, '_id': {beyond: object_id}}]}
+            query = {'$and': [query, seek]} if query else seek
+        return query
+
+    def index_keys(self):
+        # The FACET_INDEXES entry whose equality prefix matches this plan
+        equality = [field for field in ('category', 'quality') if getattr(self, field) is not None]
+        for keys in FACET_INDEXES:
+            if [field for field, _ in keys[:-2]] == equality:
+                return keys
+        return FACET_INDEXES[0]
+
+    def describe(self):
+        return {
+            'facets': self.facets,
+            'filter': self.mongo_filter(),
+            'projection': dict(RENDER_PROJECTION),
+            'sort': [['price', 1], ['_id', 1]],
+            'index': index_name(self.index_keys()) if self.facets else None
+        }
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def cursor_fingerprint(normalized_query, semantic_weight, sort, facets=None):
+    # The plan's facets are part of the search: a catalog change that alters them (a
+    # category becoming ambiguous) invalidates cursors instead of walking another ordering
+    facets = json.dumps(facets or {}, sort_keys=True, separators=(',', ':'))
+    return zlib.crc32(f'{normalized_query}|{semantic_weight}|{sort}|{facets}'.encode('utf-8'))
+
+
+def encode_cursor(position, fingerprint):
+    payload = json.dumps({**position, 'h': fingerprint}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, fingerprint):
+    # Cursors are opaque to clients; one from another query or sort order is rejected
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(position, dict) or position.get('h') != fingerprint:
+        raise ValueError('Cursor does not belong to this search')
+    if position.get('m') not in ('rank', 'browse') or not isinstance(position.get('r'), bool):
+        raise ValueError('Invalid cursor')
+    if not is_number(position.get('k')) or not isinstance(position.get('d'), int) or isinstance(position.get('d'), bool):
+        raise ValueError('Invalid cursor')
+    if 'g' in position and (not isinstance(position['g'], int) or isinstance(position['g'], bool)):
+        raise ValueError('Invalid cursor')
+    if 'o' in position:
+        # MongoDB seek position of a browse page: price and _id of its last product
+        if position['m'] != 'browse' or not is_number(position.get('p')):
+            raise ValueError('Invalid cursor')
+        if position.get('t') == 'oid':
+            if not isinstance(position['o'], str) or not OBJECT_ID_PATTERN.fullmatch(position['o']):
+                raise ValueError('Invalid cursor')
+        elif position.get('t') != 'value' or not (isinstance(position['o'], str) or is_number(position['o'])):
+            raise ValueError('Invalid cursor')
+    return position
+
+
+def plan_query(semantic_data, categories):
+    # Only facets that can narrow the catalog are pushed down: the category must exist
+    # in the catalog and quality must have been stated, not defaulted. A query naming
+    # several catalog categories ("sony headphones for my iphone") gets no category
+    # filter, since the mapping order would pick one and hide the rest. The filter uses
+    # that catalog category, not semantic_data['category'], which may not be in the catalog
+    quality = semantic_data.get('quality')
+    matched_categories = [facet for facet in semantic_data.get('matched_facets', ()) if facet in categories]
+    return QueryPlan(
+        category=matched_categories[0] if len(matched_categories) == 1 else None,
+        quality=quality if quality in semantic_data.get('matched_facets', ()) else None,
+        max_price=semantic_data.get('price_constraint')
+    )
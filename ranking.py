@@ -0,0 +1,83 @@
+import numpy as np
+
+# Shared by the in-process search path and the shard workers. Every function takes an
+# optional doc_range: a [start, end) slice of doc ids, with masks indexed from start.
+
+
+def select_page(doc_ids, keys, limit, after=None):
+    # The page of smallest (key, doc id) pairs after the cursor position. argpartition
+    # keeps this O(candidates) however deep the page is, where skip/limit grows with the offset
+    if after is not None:
+        key, doc_id = after
+        beyond = (keys > key) | ((keys == key) & (doc_ids > doc_id))
+        doc_ids, keys = doc_ids[beyond], keys[beyond]
+    remaining = len(doc_ids)
+    if remaining > limit:
+        threshold = np.partition(keys, limit - 1)[limit - 1]
+        below = np.flatnonzero(keys < threshold)
+        ties = np.flatnonzero(keys == threshold)
+        ties = ties[np.argsort(doc_ids[ties], kind='stable')][:limit - len(below)]
+        chosen = np.concatenate([below, ties])
+        doc_ids, keys = doc_ids[chosen], keys[chosen]
+    order = np.lexsort((doc_ids, keys))
+    return doc_ids[order].tolist(), keys[order].tolist(), remaining
+
+
+def anchor_after(doc_ids, keys, after):
+    # A cursor from an earlier catalog holds a key computed against it, and BM25 scores
+    # move with every document added or removed. Resume after its last document's
+    # current key instead, falling back to the old key if that document is gone
+    key, doc_id = after
+    found = np.flatnonzero(doc_ids == doc_id)
+    return (float(keys[found[0]]), doc_id) if len(found) else after
+
+
+def facet_mask(index, plan, doc_range=None):
+    # Vectorized over the catalog's code and price columns
+    start, end = doc_range or (0, len(index.docs))
+    mask = np.ones(end - start, dtype=bool)
+    for field in ('category', 'quality'):
+        value = getattr(plan, field)
+        if value is not None:
+            code = index.facet_lookup[field].get(value, -1)
+            mask &= np.frombuffer(index.facet_codes[field], dtype=np.uint16)[start:end] == code
+    if plan.max_price is not None:
+        mask &= np.frombuffer(index.prices, dtype=np.float64)[start:end] < plan.max_price
+    return mask
+
+
+def lexical_matches(index, query, mask=None, doc_range=None):
+    start = doc_range[0] if doc_range else 0
+    lexical = index.score(query, doc_range)
+    doc_ids = np.fromiter(lexical.keys(), dtype=np.int64, count=len(lexical))
+    scores = np.fromiter(lexical.values(), dtype=np.float64, count=len(lexical))
+    if mask is not None:
+        keep = mask[doc_ids - start]
+        doc_ids, scores = doc_ids[keep], scores[keep]
+    return doc_ids, scores
+
+
+def blend_semantic(embeddings, query, doc_ids, scores, semantic_weight, min_similarity, max_lexical, mask=None, doc_range=None):
+    # Lexical scores are normalized by the best one across the whole catalog, so every
+    # shard has to be given the same max_lexical for its blended scores to compare
+    start, end = doc_range or (0, len(embeddings))
+    rows, similarities = embeddings.similarities(query, doc_range)
+    if mask is not None:
+        keep = mask[rows - start]
+        rows, similarities = rows[keep], similarities[keep]
+    blended = np.zeros(end - start)
+    blended[rows - start] = semantic_weight * similarities
+    blended[doc_ids - start] += (1 - semantic_weight) * scores / max_lexical
+    matched = np.zeros(len(blended), dtype=bool)
+    matched[rows[similarities >= min_similarity] - start] = True
+    matched[doc_ids - start] = True
+    positions = np.flatnonzero(matched)
+    return positions + start, blended[positions]
+
+
+def page_keys(index, doc_ids, scores, sort):
+    # Pages run in ascending (key, doc id) order
+    if sort in ('price_asc', 'price_desc'):
+        prices = np.frombuffer(index.prices, dtype=np.float64)[doc_ids]
+        return prices if sort == 'price_asc' else -prices
+    return -scores
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class SearchResultCache:
+    # Rankings (product ids) are cached apart from rendered pages, so switching
+    # currency only re-renders instead of searching again
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.rankings = LRUCache(maxsize, ttl)
+        self.renderings = LRUCache(maxsize, ttl)
+        self.invalidations = 0
+
+    def invalidate(self):
+        self.rankings.clear()
+        self.renderings.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        return {
+            'rankings': self.rankings.stats(),
+            'renderings': self.renderings.stats(),
+            'invalidations': self.invalidations
+        }
@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+import math
+import re
+import threading
+import time
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Field weights applied to term frequencies (a light BM25F)
+FIELD_WEIGHTS = {'name': 3, 'description': 1, 'category': 2}
+
+# Fields kept as small integer code columns for facet filtering
+FACET_FIELDS = ('category', 'quality')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class ReadWriteLock:
+    # Many readers or one writer. NumPy views over the array columns block appends to
+    # them, so in-place updates wait until no reader holds a view. Waiting writers hold
+    # off new readers, so a steady stream of searches cannot starve an ingest batch.
+    # Not reentrant: take it once per call path
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+class SearchIndex:
+    def __init__(self, k1=1.2, b=0.75, field_weights=None):
+        self.k1 = k1
+        self.b = b
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.clear()
+
+    def clear(self):
+        self.docs = []
+        self.doc_lengths = array('f')
+        self.prices = array('d')
+        self.facet_codes = {field: array('H') for field in FACET_FIELDS}
+        self.facet_values = {field: [] for field in FACET_FIELDS}
+        self.facet_lookup = {field: {} for field in FACET_FIELDS}
+        self.postings = {}
+        # Term -> postings that belong to tombstoned docs, taken off df at query time
+        self.dead_postings = {}
+        self.total_length = 0.0
+        self.deleted = set()
+        self.build_seconds = 0.0
+
+    def __len__(self):
+        return len(self.docs) - len(self.deleted)
+
+    def build(self, products):
+        started = time.perf_counter()
+        self.clear()
+        for product in products:
+            self.add(product)
+        self.build_seconds = time.perf_counter() - started
+        return len(self.docs)
+
+    def term_frequencies(self, product):
+        term_freqs = {}
+        for field, weight in self.field_weights.items():
+            for token in tokenize(product.get(field)):
+                term_freqs[token] = term_freqs.get(token, 0) + weight
+        return term_freqs
+
+    def add(self, product):
+        doc_id = len(self.docs)
+        term_freqs = self.term_frequencies(product)
+        for term, tf in term_freqs.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array('I'), array('H'))
+            entry[0].append(doc_id)
+            entry[1].append(min(tf, 65535))
+
+        length = float(sum(term_freqs.values()))
+        self.docs.append(product)
+        self.doc_lengths.append(length)
+        self.prices.append(float(product.get('price') or 0.0))
+        for field in FACET_FIELDS:
+            self.facet_codes[field].append(self.facet_code(field, product.get(field)))
+        self.total_length += length
+        return doc_id
+
+    def facet_code(self, field, value):
+        lookup = self.facet_lookup[field]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.facet_values[field])
+            self.facet_values[field].append(value)
+        return code
+
+    def remove(self, doc_id):
+        # Tombstoned: postings are left in place and skipped at query time
+        if doc_id in self.deleted or doc_id >= len(self.docs):
+            return False
+        self.deleted.add(doc_id)
+        self.total_length -= self.doc_lengths[doc_id]
+        for term in self.term_frequencies(self.docs[doc_id]):
+            self.dead_postings[term] = self.dead_postings.get(term, 0) + 1
+        return True
+
+    def score(self, query, doc_range=None):
+        # doc_range limits scoring to [start, end) doc ids; df and lengths stay catalog-wide,
+        # so a range's scores equal the same docs' scores from a full pass
+        n_docs = len(self)
+        if not n_docs:
+            return {}
+
+        k1, b = self.k1, self.b
+        avg_length = (self.total_length / n_docs) or 1.0
+        doc_lengths = self.doc_lengths
+        scores = {}
+
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            doc_ids, tfs = entry
+            df = len(doc_ids) - self.dead_postings.get(term, 0)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            if doc_range is not None:
+                # Postings are appended in doc id order, so the range is one contiguous slice
+                low = bisect_left(doc_ids, doc_range[0])
+                high = bisect_left(doc_ids, doc_range[1], low)
+                doc_ids, tfs = doc_ids[low:high], tfs[low:high]
+            for doc_id, tf in zip(doc_ids, tfs):
+                norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        for doc_id in self.deleted.intersection(scores):
+            del scores[doc_id]
+        return scores
+
+    def stats(self):
+        return {
+            'documents': len(self),
+            'deleted': len(self.deleted),
+            'terms': len(self.postings),
+            'postings': sum(len(doc_ids) for doc_ids, _ in self.postings.values()),
+            'dead_postings': sum(self.dead_postings.values()),
+            'build_seconds': round(self.build_seconds, 4)
+        }
@@ -0,0 +1,121 @@
+from collections import deque
+from datetime import datetime, timezone
+import atexit
+import json
+import os
+import threading
+
+
+class SearchLogWriter:
+    # Buffers search events and writes them with insert_many from a background thread.
+    # When the queue is full the oldest events are dropped; when MongoDB is unavailable
+    # batches go to an append-only JSONL spool that is replayed once it is back.
+    def __init__(self, get_collection, spool_path=None, max_queue=10000, batch_size=500, flush_interval=2.0):
+        self.get_collection = get_collection
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = deque(maxlen=max_queue)
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.running = True
+        self.written = 0
+        self.dropped = 0
+        self.spooled = 0
+        self.failed_batches = 0
+        self.thread = threading.Thread(target=self._run, name='search-log-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, query, results_count, **fields):
+        event = {
+            "query": query,
+            "results_count": results_count,
+            "timestamp": datetime.now(timezone.utc),
+            **fields
+        }
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(event)
+            if len(self.queue) >= self.batch_size:
+                self.condition.notify()
+
+    def _take_batch(self):
+        with self.condition:
+            batch = []
+            while self.queue and len(batch) < self.batch_size:
+                batch.append(self.queue.popleft())
+            return batch
+
+    def _run(self):
+        while self.running:
+            with self.condition:
+                if len(self.queue) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            collection = self.get_collection()
+            if collection is not None:
+                self._replay_spool(collection)
+            batch = self._take_batch()
+            while batch:
+                self._write(collection, batch)
+                batch = self._take_batch()
+
+    def _write(self, collection, batch):
+        if collection is not None:
+            try:
+                collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                return
+            except Exception:
+                self.failed_batches += 1
+        self._spool(batch)
+
+    def _spool(self, batch):
+        if not self.spool_path:
+            self.dropped += len(batch)
+            return
+        with open(self.spool_path, 'a', encoding='utf-8') as spool:
+            for event in batch:
+                spool.write(json.dumps({**event, "timestamp": event["timestamp"].isoformat()}) + '\n')
+        self.spooled += len(batch)
+
+    def _replay_spool(self, collection):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        replay_path = self.spool_path + '.replay'
+        os.replace(self.spool_path, replay_path)
+        events = []
+        with open(replay_path, encoding='utf-8') as spool:
+            for line in spool:
+                try:
+                    event = json.loads(line)
+                    event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+                    events.append(event)
+                except (ValueError, KeyError):
+                    continue
+        os.remove(replay_path)
+        for start in range(0, len(events), self.batch_size):
+            self._write(collection, events[start:start + self.batch_size])
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        self.thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': len(self.queue),
+            'written': self.written,
+            'dropped': self.dropped,
+            'spooled': self.spooled,
+            'failed_batches': self.failed_batches
+        }
@@ -0,0 +1,227 @@
+import atexit
+import heapq
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+from ranking import blend_semantic, facet_mask, lexical_matches, page_keys, select_page
+from search_index import ReadWriteLock
+from snapshot import CatalogSnapshot
+
+MAX_PENDING_LEXICAL = 256
+
+
+def serve_shard(connection):
+    # Worker process: maps a catalog snapshot and answers for one [start, end) range of
+    # doc ids. The mapping is read-only, so all workers share the same page-cache pages.
+    # Requests from different coordinator threads interleave, so replies carry the
+    # request id and first-phase results wait keyed by it
+    snapshot = index = embeddings = doc_range = None
+    lexical = {}
+    while True:
+        message = connection.recv()
+        command = message[0]
+        if command == 'stop':
+            return
+        request_id = message[1]
+        try:
+            if command == 'load':
+                _, _, path, doc_range = message
+                snapshot = CatalogSnapshot(path)
+                index, embeddings = snapshot.search_index(), snapshot.embedding_index()
+                lexical.clear()
+                reply = snapshot.header['documents']
+            elif command == 'lexical':
+                # First phase of a blended query: the coordinator needs every shard's best
+                # lexical score before any of them can normalize
+                _, _, query, plan = message
+                mask = facet_mask(index, plan, doc_range) if plan is not None else None
+                doc_ids, scores = lexical_matches(index, query, mask, doc_range)
+                while len(lexical) >= MAX_PENDING_LEXICAL:
+                    # Left behind by a request that failed between its two phases
+                    del lexical[next(iter(lexical))]
+                lexical[request_id] = (mask, doc_ids, scores)
+                reply = float(scores.max()) if len(scores) else 0.0
+            elif command == 'page':
+                _, _, query, plan, semantic_weight, min_similarity, max_lexical, sort, after, limit = message
+                if request_id in lexical:
+                    mask, doc_ids, scores = lexical.pop(request_id)
+                else:
+                    mask = facet_mask(index, plan, doc_range) if plan is not None else None
+                    doc_ids, scores = lexical_matches(index, query, mask, doc_range)
+                approximate = False
+                if semantic_weight > 0 and len(embeddings):
+                    doc_ids, scores = blend_semantic(embeddings, query, doc_ids, scores, semantic_weight,
+                                                     min_similarity, max_lexical, mask, doc_range)
+                    approximate = embeddings.ivf is not None
+                page, keys, remaining = select_page(doc_ids, page_keys(index, doc_ids, scores, sort), limit, after)
+                reply = (page, keys, remaining, len(doc_ids), approximate)
+            else:
+                raise ValueError(f'unknown command {command!r}')
+            connection.send((request_id, 'ok', reply))
+        except Exception as e:
+            connection.send((request_id, 'error', f'{type(e).__name__}: {e}'))
+
+
+class ShardPool:
+    # Scatter-gather over worker processes, each owning a contiguous doc-id range of the
+    # same snapshot. A query goes to every shard, and their pages are merged on
+    # (key, doc id), so results and cursors match the single-process path exactly.
+    # Concurrent queries share the pipes: one reader thread per shard routes replies
+    # to the waiting request by id, so workers stay busy while others are still answering
+    def __init__(self, size):
+        # Forked where possible, so workers start without re-importing the application; create
+        # the pool before any driver or writer thread is running
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        # Queries share the workers; a reload waits for them and holds new ones back
+        self.lock = ReadWriteLock()
+        self.connections = []
+        self.processes = []
+        for shard in range(size):
+            parent, child = context.Pipe()
+            process = context.Process(target=serve_shard, args=(child,), name=f'search-shard-{shard}', daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.send_locks = [threading.Lock() for _ in self.connections]
+        self.waiting = {}
+        self.waiting_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.generation = None
+        self.path = None
+        self.ranges = []
+        self.loads = 0
+        self.queries = 0
+        self.errors = 0
+        self.last_error = None
+        self.load_seconds = 0.0
+        self.failed = False
+        self.closed = False
+        for shard, connection in enumerate(self.connections):
+            threading.Thread(target=self._read_replies, args=(shard, connection), name=f'search-shard-{shard}-reader', daemon=True).start()
+        atexit.register(self.close)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def _read_replies(self, shard, connection):
+        while True:
+            try:
+                request_id, status, reply = connection.recv()
+            except (EOFError, OSError) as e:
+                # A worker died: nothing more comes from this shard, so fail whoever waits on it
+                if not self.closed:
+                    self.failed, self.last_error = True, f'shard connection lost: {type(e).__name__}'
+                with self.waiting_lock:
+                    waiters = list(self.waiting.values())
+                for replies in waiters:
+                    replies.put((shard, 'error', 'shard connection lost'))
+                return
+            with self.waiting_lock:
+                replies = self.waiting.get(request_id)
+            if replies is not None:
+                replies.put((shard, status, reply))
+
+    def _call(self, request_id, messages):
+        # Every shard works on its message before any reply is waited for
+        replies = queue.Queue()
+        with self.waiting_lock:
+            self.waiting[request_id] = replies
+        try:
+            if self.failed:
+                # Checked after registering, so a reader that stopped earlier is not waited on
+                raise RuntimeError(self.last_error or 'shard pool failed')
+            for connection, send_lock, message in zip(self.connections, self.send_locks, messages):
+                with send_lock:
+                    connection.send(message)
+            # Replies arrive in completion order
+            results = sorted(replies.get() for _ in self.connections)
+        except (EOFError, OSError):
+            self.failed = True
+            raise
+        finally:
+            with self.waiting_lock:
+                del self.waiting[request_id]
+        errors = [reply for _, status, reply in results if status != 'ok']
+        if errors:
+            raise RuntimeError(errors[0])
+        return [reply for _, _, reply in results]
+
+    def load(self, path, documents, generation):
+        bounds = np.linspace(0, documents, len(self) + 1).astype(int).tolist()
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+        started = time.perf_counter()
+        with self.lock.write():
+            request_id = next(self.request_ids)
+            try:
+                self._call(request_id, [('load', request_id, path, doc_range) for doc_range in ranges])
+            except Exception as e:
+                self.generation, self.errors, self.last_error = None, self.errors + 1, str(e)
+                raise
+            self.generation, self.path, self.ranges = generation, path, ranges
+            self.loads += 1
+        self.load_seconds = time.perf_counter() - started
+
+    def ready(self, generation):
+        return not (self.failed or self.closed) and self.generation == generation
+
+    def rank_page(self, query, limit, semantic_weight, plan, sort, after, min_similarity):
+        request_id = next(self.request_ids)
+        with self.lock.read():
+            try:
+                max_lexical = 1.0
+                if semantic_weight > 0:
+                    max_lexical = max(self._call(request_id, [('lexical', request_id, query, plan)] * len(self))) or 1.0
+                pages = self._call(request_id, [
+                    ('page', request_id, query, plan, semantic_weight, min_similarity, max_lexical, sort, after, limit)
+                ] * len(self))
+            except Exception as e:
+                with self.waiting_lock:
+                    self.errors, self.last_error = self.errors + 1, str(e)
+                raise
+        with self.waiting_lock:
+            self.queries += 1
+        # Each shard's page is already in (key, doc id) order
+        merged = list(itertools.islice(heapq.merge(*(zip(keys, doc_ids) for doc_ids, keys, _, _, _ in pages)), limit))
+        return (
+            [doc_id for _, doc_id in merged],
+            [key for key, _ in merged],
+            sum(page[2] for page in pages),
+            sum(page[3] for page in pages),
+            any(page[4] for page in pages)
+        )
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for connection in self.connections:
+            try:
+                connection.send(('stop',))
+            except Exception:
+                pass
+        for process in self.processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+
+    def stats(self):
+        return {
+            'workers': len(self),
+            'alive': sum(process.is_alive() for process in self.processes),
+            'failed': self.failed,
+            'generation': self.generation,
+            'snapshot': self.path,
+            'ranges': self.ranges,
+            'loads': self.loads,
+            'load_seconds': round(self.load_seconds, 4),
+            'queries': self.queries,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
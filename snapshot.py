@@ -0,0 +1,306 @@
+from array import array
+import argparse
+from collections.abc import Sequence
+from datetime import datetime, timezone
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex, HashedNgramVectorizer, IVFQuantizer
+from search_index import FACET_FIELDS, SearchIndex
+
+# File layout: magic, header length, JSON header, then 64-byte aligned sections.
+# Bump SNAPSHOT_VERSION whenever a section changes meaning.
+SNAPSHOT_MAGIC = b'CATSNAP\x00'
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 64
+STRING_FIELDS = ('product_id', 'name', 'description')
+
+
+def string_sections(name, values):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = array('Q', [0])
+    total = 0
+    for value in encoded:
+        total += len(value)
+        offsets.append(total)
+    return {f'{name}.offsets': offsets, f'{name}.blob': b''.join(encoded)}
+
+
+def write_snapshot(path, index, embeddings, source=None):
+    started = time.perf_counter()
+    docs = index.docs
+    sections = {
+        'prices': index.prices,
+        'doc_lengths': index.doc_lengths,
+        'deleted': array('I', sorted(index.deleted))
+    }
+    for field in FACET_FIELDS:
+        sections[f'facet.{field}'] = index.facet_codes[field]
+    keys = [str(doc.get('product_id', doc.get('_id', ''))) for doc in docs]
+    for field in STRING_FIELDS:
+        values = keys if field == 'product_id' else [str(doc.get(field) or '') for doc in docs]
+        sections.update(string_sections(field, values))
+    # Rows ordered by product key, so keys resolve with a binary search instead of a dict
+    sections['key_order'] = array('I', sorted(range(len(keys)), key=keys.__getitem__))
+
+    terms = sorted(index.postings)
+    posting_offsets = array('Q', [0])
+    posting_ids, posting_tfs = array('I'), array('H')
+    deleted = index.deleted
+    for term in terms:
+        doc_ids, tfs = index.postings[term]
+        if deleted:
+            # Tombstoned postings are left out, so df read from the snapshot counts live docs only
+            live = [i for i, doc_id in enumerate(doc_ids) if doc_id not in deleted]
+            doc_ids, tfs = [doc_ids[i] for i in live], [tfs[i] for i in live]
+        posting_ids.extend(doc_ids)
+        posting_tfs.extend(tfs)
+        posting_offsets.append(len(posting_ids))
+    sections.update(string_sections('terms', terms))
+    sections.update({
+        'postings.offsets': posting_offsets,
+        'postings.doc_ids': posting_ids,
+        'postings.tfs': posting_tfs,
+        'embeddings': np.ascontiguousarray(embeddings.vectors)
+    })
+    if embeddings.ivf is not None:
+        list_offsets = np.cumsum([0] + [len(rows) for rows in embeddings.ivf.lists], dtype=np.uint64)
+        sections.update({
+            'ivf.centroids': np.ascontiguousarray(embeddings.ivf.centroids),
+            'ivf.offsets': list_offsets,
+            'ivf.rows': np.concatenate([np.asarray(rows, dtype=np.uint32) for rows in embeddings.ivf.lists] or [np.empty(0, np.uint32)])
+        })
+
+    layout, position = {}, 0
+    for name, data in sections.items():
+        view = memoryview(data)
+        layout[name] = {'offset': position, 'bytes': view.nbytes, 'format': view.format, 'shape': list(view.shape)}
+        position += -(-view.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'source': source,
+        'documents': len(docs),
+        'terms': len(terms),
+        'total_length': index.total_length,
+        'k1': index.k1,
+        'b': index.b,
+        'field_weights': index.field_weights,
+        'facet_values': index.facet_values,
+        'embedding_dims': embeddings.vectorizer.dims,
+        'embedding_ngram_range': list(embeddings.vectorizer.ngram_range),
+        'embedding_ivf_probe': embeddings.ivf_probe,
+        'sections': layout
+    }).encode('utf-8')
+    data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # Written beside the target and renamed over it, so processes that still map the
+    # previous file keep a consistent view of it
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, data in sections.items():
+            if layout[name]['bytes']:
+                f.seek(data_start + layout[name]['offset'])
+                f.write(memoryview(data).cast('B'))
+        f.truncate(data_start + position)
+    os.replace(temp_path, path)
+    return {'path': path, 'documents': len(docs), 'bytes': data_start + position, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+class StringColumn(Sequence):
+    # Offset-indexed UTF-8 blob; strings are decoded only when accessed
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class SnapshotDocs(Sequence):
+    # Product documents assembled from the columns on access
+    def __init__(self, snapshot):
+        self.strings = {field: snapshot.strings(field) for field in STRING_FIELDS}
+        self.prices = snapshot.section('prices')
+        self.facet_codes = {field: snapshot.section(f'facet.{field}') for field in FACET_FIELDS}
+        self.facet_values = snapshot.header['facet_values']
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, doc_id):
+        product = {field: column[doc_id] for field, column in self.strings.items()}
+        for field in FACET_FIELDS:
+            product[field] = self.facet_values[field][self.facet_codes[field][doc_id]]
+        product['price'] = self.prices[doc_id]
+        return product
+
+
+class SnapshotPostings:
+    # Term -> (doc ids, term frequencies) as slices of the mapped file, found by binary search
+    def __init__(self, snapshot):
+        self.terms = snapshot.strings('terms')
+        self.offsets = snapshot.section('postings.offsets')
+        self.doc_ids = snapshot.section('postings.doc_ids')
+        self.tfs = snapshot.section('postings.tfs')
+
+    def __len__(self):
+        return len(self.terms)
+
+    def position(self, term):
+        low, high = 0, len(self.terms)
+        while low < high:
+            middle = (low + high) // 2
+            if self.terms[middle] < term:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self.terms) and self.terms[low] == term else None
+
+    def entry(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    def get(self, term, default=None):
+        position = self.position(term)
+        return default if position is None else self.entry(position)
+
+    def __contains__(self, term):
+        return self.position(term) is not None
+
+    def values(self):
+        return (self.entry(position) for position in range(len(self)))
+
+
+class SnapshotKeys:
+    # Product key -> doc id through the key-sorted row order
+    def __init__(self, snapshot):
+        self.keys = snapshot.strings('product_id')
+        self.order = snapshot.section('key_order')
+
+    def __len__(self):
+        return len(self.order)
+
+    def get(self, key, default=None):
+        key = str(key)
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.keys[self.order[middle]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.order) and self.keys[self.order[low]] == key:
+            return self.order[low]
+        return default
+
+
+class CatalogSnapshot:
+    # Sections are memoryviews over one read-only mapping: nothing is copied on load, and
+    # every process that opens the file shares the same page-cache pages
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.buffer = memoryview(self.mmap)
+        if bytes(self.buffer[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        header_length = struct.unpack_from('<Q', self.buffer, len(SNAPSHOT_MAGIC))[0]
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        self.header = json.loads(bytes(self.buffer[header_start:header_start + header_length]))
+        if self.header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is snapshot version {self.header['version']}, expected {SNAPSHOT_VERSION}")
+        self.data_start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+
+    def section(self, name):
+        layout = self.header['sections'][name]
+        start = self.data_start + layout['offset']
+        if not layout['bytes']:
+            # memoryview cannot cast an empty view
+            return memoryview(array(layout['format']))
+        view = self.buffer[start:start + layout['bytes']]
+        return view.cast(layout['format'], layout['shape']) if layout['format'] != 'B' else view
+
+    def array(self, name, dtype):
+        layout = self.header['sections'][name]
+        return np.frombuffer(self.mmap, dtype=dtype, count=layout['bytes'] // np.dtype(dtype).itemsize,
+                             offset=self.data_start + layout['offset'])
+
+    def strings(self, name):
+        return StringColumn(self.section(f'{name}.offsets'), self.section(f'{name}.blob'))
+
+    def search_index(self):
+        header = self.header
+        index = SearchIndex(header['k1'], header['b'], header['field_weights'])
+        index.docs = SnapshotDocs(self)
+        index.doc_lengths = self.section('doc_lengths')
+        index.prices = self.section('prices')
+        index.facet_codes = {field: self.section(f'facet.{field}') for field in FACET_FIELDS}
+        index.facet_values = header['facet_values']
+        index.facet_lookup = {
+            field: {value: code for code, value in enumerate(values)} for field, values in header['facet_values'].items()
+        }
+        index.postings = SnapshotPostings(self)
+        index.total_length = header['total_length']
+        index.deleted = set(self.section('deleted'))
+        return index
+
+    def embedding_index(self):
+        header = self.header
+        dims = header['embedding_dims']
+        embeddings = EmbeddingIndex(HashedNgramVectorizer(dims, tuple(header['embedding_ngram_range'])),
+                                    ivf_probe=header['embedding_ivf_probe'])
+        embeddings.matrix = self.array('embeddings', np.float32).reshape(-1, dims)
+        embeddings.size = len(embeddings.matrix)
+        if 'ivf.centroids' in header['sections']:
+            ivf = IVFQuantizer(0, header['embedding_ivf_probe'])
+            ivf.centroids = self.array('ivf.centroids', np.float32).reshape(-1, dims)
+            offsets, rows = self.section('ivf.offsets'), self.section('ivf.rows')
+            ivf.lists = [rows[offsets[c]:offsets[c + 1]] for c in range(len(ivf.centroids))]
+            embeddings.ivf = ivf
+        return embeddings
+
+    def keys(self):
+        return SnapshotKeys(self)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'version': self.header['version'],
+            'created_at': self.header['created_at'],
+            'source': self.header['source'],
+            'documents': self.header['documents'],
+            'bytes': len(self.mmap)
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the catalog and its search indexes to a memory-mapped snapshot')
+    parser.add_argument('--output', default=os.getenv('CATALOG_SNAPSHOT', 'catalog.snapshot'))
+    args = parser.parse_args(argv)
+
+    from app import mongo_db
+    if not mongo_db.wait_until_connected():
+        print('MongoDB connection failed. Check your .env file.', file=sys.stderr)
+        return 1
+    if mongo_db.index_source != 'mongodb':
+        mongo_db.build_index()
+    if mongo_db.index_source != 'mongodb':
+        print('Could not read the catalog from MongoDB.', file=sys.stderr)
+        return 1
+    print(json.dumps(write_snapshot(args.output, mongo_db.index, mongo_db.embeddings, source='mongodb')))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
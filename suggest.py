@@ -0,0 +1,190 @@
+from array import array
+import bisect
+import heapq
+import threading
+import time
+
+# Suffix array positions are grouped into blocks. A sparse table keeps the top entries of
+# every power-of-two run of blocks, so any prefix range is ranked from two of those lists
+# plus its partial edge blocks, however many keys it spans
+BLOCK_SIZE = 128
+# New and boosted entries wait in a second, small sorted array with its own tops; it is
+# folded into the main one (and the main tops recomputed) once it passes this share of it
+DELTA_RATIO = 0.05
+MIN_DELTA_KEYS = 2000
+# Catalog rebuilds are spaced so they take at most this share of the refresh thread's time
+REBUILD_DUTY = 0.02
+
+
+def normalize_text(text):
+    return ' '.join(str(text).lower().split())
+
+
+class SuggestionIndex:
+    # Sorted array of word-start suffixes searched with bisect. Each entry is indexed
+    # once per word, so "pro" finds "MacBook Pro M3"; weights rank the matches.
+    def __init__(self, limit=8):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending = {}
+        self.dirty = False
+        self.last_build = 0.0
+        self.build_seconds = 0.0
+        self.refresh_thread = None
+        self.stop_event = threading.Event()
+        self.build([])
+
+    def build(self, weighted_texts):
+        with self.write_lock:
+            started = time.perf_counter()
+            texts, weights, entry_ids = [], array('d'), {}
+            for text, weight in weighted_texts:
+                key = normalize_text(text)
+                if not key:
+                    continue
+                entry_id = entry_ids.get(key)
+                if entry_id is None:
+                    entry_id = entry_ids[key] = len(texts)
+                    texts.append(str(text).strip())
+                    weights.append(0.0)
+                weights[entry_id] += weight
+
+            pairs = sorted((suffix, entry_id) for key, entry_id in entry_ids.items() for suffix in self._suffixes(key))
+            keys = [suffix for suffix, _ in pairs]
+            key_entries = array('I', (entry_id for _, entry_id in pairs))
+            tops = self._tops(key_entries, weights)
+            with self.lock:
+                self.texts, self.weights, self.entry_ids = texts, weights, entry_ids
+                self.keys, self.key_entries, self.tops = keys, key_entries, tops
+                self.delta_keys, self.delta_entries, self.delta_tops, self.delta_members = [], array('I'), [], set()
+                self.main_entries = len(texts)
+                self.dirty = False
+            self.build_seconds = time.perf_counter() - started
+            self.last_build = time.monotonic()
+            return len(texts)
+
+    @staticmethod
+    def _suffixes(key):
+        words = key.split(' ')
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def _tops(self, key_entries, weights):
+        # tops[j][b]: best entries of blocks b .. b + 2**j - 1
+        blocks = [self._rank(set(key_entries[start:start + BLOCK_SIZE]), weights)
+                  for start in range(0, len(key_entries), BLOCK_SIZE)]
+        tops = [blocks]
+        width = 1
+        while 2 * width <= len(blocks):
+            previous = tops[-1]
+            tops.append([self._rank(set(previous[b] + previous[b + width]), weights) for b in range(len(previous) - width)])
+            width *= 2
+        return tops
+
+    def _rank(self, entry_ids, weights):
+        return heapq.nlargest(self.limit, entry_ids, key=lambda entry_id: (weights[entry_id], -entry_id))
+
+    @staticmethod
+    def _candidates(key_entries, tops, low, high):
+        first_block, end_block = -(-low // BLOCK_SIZE), high // BLOCK_SIZE
+        if first_block >= end_block:
+            return list(key_entries[low:high])
+        candidates = list(key_entries[low:first_block * BLOCK_SIZE]) + list(key_entries[end_block * BLOCK_SIZE:high])
+        level = (end_block - first_block).bit_length() - 1
+        # Two runs of 2**level blocks that together cover the full blocks; they may overlap
+        return candidates + tops[level][first_block] + tops[level][end_block - (1 << level)]
+
+    def record(self, text, weight=1.0):
+        # Cheap on the request path; merged by apply_pending in the background
+        key = normalize_text(text)
+        if key:
+            with self.lock:
+                display, total = self.pending.get(key, (str(text).strip(), 0.0))
+                self.pending[key] = (display, total + weight)
+
+    def apply_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        with self.write_lock:
+            # Weights only grow, so a boosted entry can only rise past the stored block tops;
+            # putting it in the delta array gets it ranked with its current weight
+            new_pairs = []
+            for key, (display, weight) in pending.items():
+                entry_id = self.entry_ids.get(key)
+                if entry_id is None:
+                    entry_id = self.entry_ids[key] = len(self.texts)
+                    self.texts.append(display)
+                    self.weights.append(0.0)
+                if entry_id not in self.delta_members:
+                    self.delta_members.add(entry_id)
+                    new_pairs.extend((suffix, entry_id) for suffix in self._suffixes(key))
+                self.weights[entry_id] += weight
+
+            merged = list(heapq.merge(zip(self.delta_keys, self.delta_entries), sorted(new_pairs)))
+            if len(merged) <= max(MIN_DELTA_KEYS, DELTA_RATIO * len(self.keys)):
+                delta_keys = [suffix for suffix, _ in merged]
+                delta_entries = array('I', (entry_id for _, entry_id in merged))
+                delta_tops = self._tops(delta_entries, self.weights)
+                with self.lock:
+                    self.delta_keys, self.delta_entries, self.delta_tops = delta_keys, delta_entries, delta_tops
+                return len(pending)
+
+            # Fold: entries added since the last fold join the main array; boosted ones are
+            # already in it and only need the tops recomputed
+            added = [(suffix, entry_id) for suffix, entry_id in merged if entry_id >= self.main_entries]
+            main = list(heapq.merge(zip(self.keys, self.key_entries), added))
+            keys = [suffix for suffix, _ in main]
+            key_entries = array('I', (entry_id for _, entry_id in main))
+            tops = self._tops(key_entries, self.weights)
+            with self.lock:
+                self.keys, self.key_entries, self.tops = keys, key_entries, tops
+                self.delta_keys, self.delta_entries, self.delta_tops, self.delta_members = [], array('I'), [], set()
+                self.main_entries = len(self.texts)
+        return len(pending)
+
+    def suggest(self, prefix, limit=None):
+        limit = min(limit or self.limit, self.limit)
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            texts, weights, keys, key_entries, tops = self.texts, self.weights, self.keys, self.key_entries, self.tops
+            delta_keys, delta_entries, delta_tops = self.delta_keys, self.delta_entries, self.delta_tops
+        low = bisect.bisect_left(keys, prefix)
+        high = bisect.bisect_left(keys, prefix + '￿', low)
+        candidates = self._candidates(key_entries, tops, low, high)
+        low = bisect.bisect_left(delta_keys, prefix)
+        high = bisect.bisect_left(delta_keys, prefix + '￿', low)
+        candidates += self._candidates(delta_entries, delta_tops, low, high)
+        return [texts[entry_id] for entry_id in self._rank(set(candidates), weights)[:limit]]
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def start_refresh(self, load, interval=60.0):
+        # Rebuilds from load() after catalog changes; otherwise merges recorded queries
+        def run():
+            while not self.stop_event.wait(interval):
+                try:
+                    if self.dirty and time.monotonic() - self.last_build >= self.build_seconds / REBUILD_DUTY:
+                        self.build(load())
+                    self.apply_pending()
+                except Exception:
+                    pass
+
+        if self.refresh_thread is None:
+            self.refresh_thread = threading.Thread(target=run, name='suggest-refresh', daemon=True)
+            self.refresh_thread.start()
+
+    def stats(self):
+        return {
+            'entries': len(self.texts),
+            'keys': len(self.keys),
+            'delta_keys': len(self.delta_keys),
+            'pending': len(self.pending),
+            'blocks': len(self.tops[0]),
+            'build_seconds': round(self.build_seconds, 3)
+        }
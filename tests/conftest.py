@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+os.environ['MONGODB_URI'] = 'mongomock://tests'
+os.environ['SEARCH_LOG_SPOOL'] = ''
+os.environ['SEARCH_SHARDS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def search_app():
+    import app
+    from benchmark import generate_catalog
+    app.mongo_db.wait_until_connected()
+    app.mongo_db.products.delete_many({})
+    app.mongo_db.products.insert_many(list(generate_catalog(300)))
+    app.mongo_db.build_index()
+    return app
+
+
+@pytest.fixture
+def cold_cache(search_app):
+    search_app.search_cache.invalidate()
+    yield
+    search_app.search_cache.invalidate()
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlencode
+
+import pytest
+
+
+@pytest.fixture
+def asgi(search_app):
+    import asgi
+    return asgi
+
+
+def external_result(source, url_template, query, quality, currency):
+    return {'name': f'{query} - {source} Result', 'desc': f'External result from {source}', 'price': '$100.99',
+            'source': source, 'url': url_template.format(query=query), 'is_db': False}
+
+
+@pytest.fixture
+def fixed_external(monkeypatch, search_app, asgi):
+    # external_result prices are random; both front ends get the same fixed ones
+    monkeypatch.setattr(search_app, 'external_result', external_result)
+    monkeypatch.setattr(asgi, 'external_result', external_result)
+
+
+def asgi_get(application, params):
+    messages = []
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': '/search', 'raw_path': b'/search', 'query_string': urlencode(params).encode(), 'root_path': '',
+        'headers': [], 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80)
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start, body = messages
+    headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], headers, body['body'].decode('utf-8')
+
+
+def test_json_matches_flask_route(search_app, asgi, cold_cache, fixed_external):
+    params = {'q': 'sony headphones', 'format': 'json', 'currency': 'EUR', 'page_size': 5}
+    flask = search_app.app.test_client().get('/search', query_string=params)
+    search_app.search_cache.invalidate()
+    status, headers, body = asgi_get(asgi.application, params)
+
+    assert status == flask.status_code == 200
+    assert flask.get_json()['results'] and flask.get_json()['next_cursor']
+    assert json.loads(body) == flask.get_json()
+    for name in ('x-total-hits', 'x-total-hits-relation', 'x-next-cursor'):
+        assert headers.get(name) == flask.headers.get(name)
+
+
+def test_next_page_matches_flask_route(search_app, asgi, cold_cache, fixed_external):
+    params = {'q': 'cheap laptop', 'format': 'json', 'page_size': 3}
+    cursor = search_app.app.test_client().get('/search', query_string=params).get_json()['next_cursor']
+    assert cursor
+    params['cursor'] = cursor
+    search_app.search_cache.invalidate()
+    flask = search_app.app.test_client().get('/search', query_string=params)
+    search_app.search_cache.invalidate()
+    status, _, body = asgi_get(asgi.application, params)
+
+    assert status == 200
+    assert json.loads(body) == flask.get_json()
+    # External sources only join the first page
+    assert all(result['is_db'] for result in json.loads(body)['results'])
+
+
+def test_foreign_cursor_is_rejected(search_app, asgi, cold_cache):
+    cursor = search_app.app.test_client().get('/search', query_string={'q': 'laptop', 'format': 'json', 'page_size': 3}).get_json()['next_cursor']
+    params = {'q': 'phone', 'format': 'json', 'cursor': cursor}
+    status, _, body = asgi_get(asgi.application, params)
+
+    assert status == 400
+    assert json.loads(body) == search_app.app.test_client().get('/search', query_string=params).get_json()
+
+
+def test_slow_and_failing_sources_are_dropped(search_app, asgi, cold_cache, monkeypatch):
+    def flaky_result(source, url_template, query, quality, currency):
+        if source == 'Slow':
+            time.sleep(1.0)
+        if source == 'Broken':
+            raise ConnectionError('source unavailable')
+        return external_result(source, url_template, query, quality, currency)
+
+    monkeypatch.setattr(asgi, 'external_result', flaky_result)
+    monkeypatch.setattr(asgi, 'EXTERNAL_SOURCE_TIMEOUT', 0.1)
+    monkeypatch.setattr(asgi, 'EXTERNAL_SOURCES', [
+        ('Slow', 'https://slow.example/?q={query}'),
+        ('Broken', 'https://broken.example/?q={query}'),
+        ('Working', 'https://working.example/?q={query}')
+    ])
+    started = time.perf_counter()
+    status, _, body = asgi_get(asgi.application, {'q': 'laptop', 'format': 'json'})
+
+    assert status == 200
+    assert time.perf_counter() - started < 0.9
+    sources = [result['source'] for result in json.loads(body)['results'] if not result['is_db']]
+    assert sources == ['Working']
+
+
+def test_empty_query(search_app, asgi):
+    status, headers, body = asgi_get(asgi.application, {'q': '  '})
+
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert body == search_app.app.test_client().get('/search?q=').get_data(as_text=True)
+
+
+@pytest.mark.parametrize('semantic, expected', [('0.25', 0.25), ('-3', 0.0), ('7', 1.0), ('nan', None), ('inf', None), ('x', None)])
+def test_semantic_weight_is_clamped(search_app, semantic, expected):
+    weight = search_app.parse_search_params({'q': 'sony', 'semantic': semantic})['semantic_weight']
+
+    assert weight == (search_app.SEMANTIC_WEIGHT if expected is None else expected)
+
+
+def test_stale_rendering_is_not_served_after_catalog_change(search_app, asgi, cold_cache, fixed_external):
+    mongo_db = search_app.mongo_db
+    params = {'q': 'garmin', 'format': 'json'}
+    search = search_app.start_search(search_app.parse_search_params(params))
+    try:
+        mongo_db.upsert_products([{'product_id': 'R00000001', 'name': 'Garmin Venu 3', 'description': 'Smartwatch',
+                                   'category': 'fitness', 'quality': 'premium_quality', 'price': 449.0}])
+        # A render that started before the change finishes after its invalidation
+        search_app.search_cache.renderings.set(search['rendering_key'], {'results': []})
+        status, _, body = asgi_get(asgi.application, params)
+
+        assert status == 200
+        assert 'Garmin Venu 3' in [result['name'] for result in json.loads(body)['results']]
+    finally:
+        mongo_db.products.delete_many({'product_id': 'R00000001'})
+        mongo_db.build_index()
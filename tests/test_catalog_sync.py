@@ -0,0 +1,40 @@
+from pymongo import UpdateOne
+
+
+def search_names(search_app, query):
+    search_app.search_cache.invalidate()
+    payload = search_app.app.test_client().get('/search', query_string={'q': query, 'format': 'json', 'semantic': 0}).get_json()
+    return [result['name'] for result in payload['results'] if result['is_db']]
+
+
+def test_writes_from_another_process_are_indexed(search_app):
+    mongo_db = search_app.mongo_db
+    product = {'product_id': 'S00000001', 'name': 'Garmin Forerunner 965', 'description': 'GPS running watch',
+               'category': 'fitness', 'quality': 'premium_quality', 'price': 599.0}
+    try:
+        # What ingestion.py or another worker does: the write skips this process's indexes
+        mongo_db.products.bulk_write([
+            UpdateOne({'product_id': product['product_id']}, {'$set': product, **search_app.STAMP_UPDATED_AT}, upsert=True)
+        ])
+        assert 'Garmin Forerunner 965' not in search_names(search_app, 'garmin forerunner')
+
+        assert mongo_db.sync_catalog() >= 1
+        assert search_names(search_app, 'garmin forerunner')[0] == 'Garmin Forerunner 965'
+
+        mongo_db.products.update_one({'product_id': product['product_id']},
+                                     {'$set': {'name': 'Garmin Forerunner 265'}, **search_app.STAMP_UPDATED_AT})
+        mongo_db.sync_catalog()
+        names = search_names(search_app, 'garmin forerunner')
+        assert names[0] == 'Garmin Forerunner 265' and 'Garmin Forerunner 965' not in names
+    finally:
+        mongo_db.products.delete_many({'product_id': product['product_id']})
+        mongo_db.build_index()
+
+
+def test_sync_skips_indexed_products(search_app):
+    mongo_db = search_app.mongo_db
+    deleted = len(mongo_db.index.deleted)
+    mongo_db.sync_catalog()
+    mongo_db.sync_catalog()
+
+    assert len(mongo_db.index.deleted) == deleted
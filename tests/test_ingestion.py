@@ -0,0 +1,18 @@
+import pytest
+
+from ingestion import normalize_product, parse_price
+
+
+@pytest.mark.parametrize('value, expected', [
+    (19.5, 19.5), ('$1,299.00', 1299.0), (' 42 ', 42.0),
+    ('nan', None), ('inf', None), ('-Infinity', None), (float('nan'), None), (10 ** 400, None), ('cheap', None)
+])
+def test_parse_price(value, expected):
+    assert parse_price(value) == expected
+
+
+def test_non_finite_price_is_rejected(search_app):
+    row = {'name': 'x', 'price': 'inf', 'category': 'computer', 'quality': 'mid_range'}
+
+    assert normalize_product(row, search_app.semantic_ai) is None
+    assert normalize_product({**row, 'price': '12'}, search_app.semantic_ai)['price'] == 12.0
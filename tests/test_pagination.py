@@ -0,0 +1,108 @@
+import base64
+import json
+
+import pytest
+
+
+def get_page(search_app, **params):
+    search_app.search_cache.invalidate()
+    return search_app.app.test_client().get('/search', query_string={'format': 'json', 'semantic': 0, **params})
+
+
+def walk(search_app, query, page_size=3):
+    names, cursor, pages = [], None, 0
+    while True:
+        params = {'q': query, 'page_size': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        response = get_page(search_app, **params)
+        assert response.status_code == 200
+        payload = response.get_json()
+        names += [result['name'] for result in payload['results'] if result['is_db']]
+        pages += 1
+        cursor = payload['next_cursor']
+        if not cursor:
+            return names, pages, payload['total_hits']
+
+
+def single_page(search_app, query):
+    mongo_db = search_app.mongo_db
+    plan = mongo_db.plan_search(search_app.semantic_ai.extract_semantic_meaning(query))
+    page = mongo_db.search_page(query, 1000, 0.0, plan)
+    return page, [product['name'] for product in mongo_db.get_products(page['doc_ids'])]
+
+
+def tamper(cursor, **changes):
+    position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    payload = json.dumps({**position, **changes}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+@pytest.mark.parametrize('query, mode, relaxed', [
+    ('sony', 'rank', False),
+    ('cheap laptops', 'rank', False),
+    ('portable laptops', 'browse', False),
+    ('premium laptop under $300', 'rank', True)
+])
+def test_cursor_round_trip(search_app, query, mode, relaxed):
+    page, expected = single_page(search_app, query)
+    assert (page['mode'], page['relaxed']) == (mode, relaxed)
+
+    names, pages, total = walk(search_app, query)
+    assert pages > 1
+    assert names == expected
+    assert total == len(expected)
+
+
+def test_cursor_for_missing_mode_is_rejected(search_app):
+    cursor = get_page(search_app, q='sony', page_size=3).get_json()['next_cursor']
+
+    # A plain keyword search has no facets to browse, nor a relaxed stage
+    for forged in (tamper(cursor, m='browse'), tamper(cursor, r=True)):
+        response = get_page(search_app, q='sony', page_size=3, cursor=forged)
+        assert response.status_code == 400
+
+
+def test_catalog_change_between_pages(search_app):
+    mongo_db = search_app.mongo_db
+    cursor = get_page(search_app, q='portable laptops', page_size=3).get_json()['next_cursor']
+    try:
+        # A second category matching the query leaves the plan without a category facet
+        mongo_db.upsert_products([{
+            'product_id': 'T00000001', 'name': 'Travel Pillow', 'description': 'Portable neck pillow',
+            'category': 'travel', 'quality': 'mid_range', 'price': 25.0
+        }])
+        response = get_page(search_app, q='portable laptops', page_size=3, cursor=cursor)
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Cursor does not belong to this search'}
+    finally:
+        mongo_db.products.delete_many({'product_id': 'T00000001'})
+        mongo_db.build_index()
+
+
+def test_catalog_change_keeping_the_plan(search_app):
+    mongo_db = search_app.mongo_db
+    first = get_page(search_app, q='sony', page_size=3).get_json()
+    try:
+        mongo_db.upsert_products([{
+            'product_id': 'T00000002', 'name': 'Sony Earbuds 1000', 'description': 'Decent earbuds for travel',
+            'category': 'audio_device', 'quality': 'mid_range', 'price': 150.0
+        }])
+        response = get_page(search_app, q='sony', page_size=3, cursor=first['next_cursor'])
+        assert response.status_code == 200
+        seen = {result['name'] for result in first['results'] if result['is_db']}
+        assert not seen & {result['name'] for result in response.get_json()['results']}
+    finally:
+        mongo_db.products.delete_many({'product_id': 'T00000002'})
+        mongo_db.build_index()
+
+
+def test_page_renders_from_its_own_index(search_app):
+    mongo_db = search_app.mongo_db
+    page, expected = single_page(search_app, 'sony')
+    try:
+        # A rebuild (or compaction) swaps in a smaller index before the page is rendered
+        mongo_db.install_catalog(list(mongo_db.index.docs[:10]), mongo_db.index_source)
+        assert [product['name'] for product in mongo_db.get_products(page['doc_ids'], page['docs'])] == expected
+    finally:
+        mongo_db.build_index()
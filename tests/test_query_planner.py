@@ -0,0 +1,25 @@
+from query_planner import plan_query
+
+
+def semantic(category, matched_facets, quality='mid_range'):
+    return {'category': category, 'quality': quality, 'price_constraint': None, 'matched_facets': matched_facets}
+
+
+def test_category_is_the_one_in_the_catalog():
+    # "running watch for my phone" on a catalog with fitness products and no phones
+    plan = plan_query(semantic('mobile_device', ['fitness', 'mobile_device']), {'fitness': 0, 'computer': 1})
+
+    assert plan.facets == {'category': 'fitness'}
+
+
+def test_several_catalog_categories_leave_the_category_open():
+    plan = plan_query(semantic('audio_device', ['audio_device', 'mobile_device']), {'audio_device': 0, 'mobile_device': 1})
+
+    assert plan.category is None
+
+
+def test_quality_only_when_stated():
+    categories = {'computer': 0}
+
+    assert plan_query(semantic('computer', ['computer']), categories).quality is None
+    assert plan_query(semantic('computer', ['computer', 'premium_quality'], 'premium_quality'), categories).quality == 'premium_quality'